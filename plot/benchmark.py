@@ -0,0 +1,361 @@
+#! /usr/bin/env python3
+"""
+Benchmark the readers of read_output.py on synthetic data.
+
+Usage:
+
+     python benchmark.py [--size MB] [--repeat N] [--dir DIRECTORY]
+
+writes synthetic .his, .his2, .his3, .out and .tra files of about MB megabytes 
+each (default 10) to DIRECTORY (default: a temporary directory) and reports 
+for each reader the time (best of N runs), the throughput in MB/s and 
+items/s, and the peak memory used by a run. The peak memory is the increase 
+of the maximum resident set size of a fresh process during the run, so that 
+memory-mapped files are included. Items are histogram values for histogram 
+files, lines for .out files and collision points for .tra files.
+
+The write_* functions can also be used to generate test data.
+"""
+import argparse, multiprocessing, os, random, resource, struct, sys, tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import read_output
+
+
+def write_his(fname, nrecords=2, ncolumns=3, npoints=1000, seed=0):
+    """
+    Write a 1D histogram file with nrecords records of ncolumns atom species 
+    and npoints points (two per box).
+    """
+    rng = np.random.default_rng(seed)
+    nboxes = npoints // 2
+    with open(fname, 'w') as f:
+        for irec in range(nrecords):
+            f.write('# synthetic histogram, record %d\n' % (irec+1))
+            f.write('%d %d\n' % (ncolumns, 2*nboxes))
+            f.write('  depth' + ''.join('  atom%d' % (i+1) 
+                                        for i in range(ncolumns)) + '\n')
+            edges = np.linspace(0., 1000., nboxes+1)
+            x = np.vstack((edges[:-1], edges[1:])).T.flatten()
+            depth = np.linspace(0., 1., nboxes)
+            hist = np.exp(-(depth[:,None] - rng.random(ncolumns))**2 / 0.02)
+            hist = np.repeat(hist, 2, axis=0)
+            np.savetxt(f, np.column_stack((x, hist)), fmt='%14.6E')
+    return nrecords * 2*nboxes * ncolumns
+
+
+def _write_record(f, data):
+    """
+    Write an unformatted sequential Fortran record.
+    """
+    data = np.ascontiguousarray(data).tobytes()
+    marker = struct.pack('<i', len(data))
+    f.write(marker + data + marker)
+
+
+def _title(text):
+    return np.frombuffer(text.ljust(80).encode(), dtype='S1')
+
+
+def write_his2(fname, nrecords=1, natoms=2, nz=200, nx=100, seed=0):
+    """
+    Write a 2D histogram file in the format read by read_his2.
+    """
+    rng = np.random.default_rng(seed)
+    z = np.linspace(0., 1000., nz)
+    x = np.linspace(-500., 500., nx)
+    with open(fname, 'wb') as f:
+        for irec in range(nrecords):
+            _write_record(f, _title('record %d, Z=' % (irec+1) 
+                                    + ','.join(['14']*natoms)))
+            _write_record(f, np.array((nz, nx, natoms), dtype='<i4'))
+            _write_record(f, z)
+            _write_record(f, x)
+            for __ in range(natoms):
+                center = rng.random() * 1000.
+                hist = np.exp(-(z[:,None] - center)**2 / 2e4 
+                              - x[None,:]**2 / 1e4)
+                _write_record(f, hist)
+    return nrecords * natoms * nz * nx
+
+
+def write_his3(fname, nrecords=1, natoms=2, nx=50, ny=50, nz=100, seed=0):
+    """
+    Write a 3D histogram file in the format read by read_his3.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-500., 500., nx)
+    y = np.linspace(-500., 500., ny)
+    z = np.linspace(0., 1000., nz)
+    with open(fname, 'wb') as f:
+        for irec in range(nrecords):
+            _write_record(f, _title('record %d, Z=' % (irec+1) 
+                                    + ','.join(['14']*natoms)))
+            _write_record(f, np.array((natoms, nx, ny, nz), dtype='<i4'))
+            _write_record(f, x)
+            _write_record(f, y)
+            _write_record(f, z)
+            for __ in range(natoms):
+                center = rng.random() * 1000.
+                hist = np.exp(-(z[:,None,None] - center)**2 / 2e4 
+                              - y[None,:,None]**2 / 1e4 
+                              - x[None,None,:]**2 / 1e4)
+                _write_record(f, hist)
+    return nrecords * natoms * nx * ny * nz
+
+
+def write_out(fname, nlines=10000, ncolumns=3, seed=0):
+    """
+    Write an out file with about nlines lines of parameter listing followed by 
+    lattice information and yield moments of ncolumns atom species.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for i in range(nlines):
+        lines.append(' PARAM%06d = %14.6E\n' % (i, rng.random()))
+    lines.append(' crystal system=cubic, lattice constant=5.431\n')
+    for name, vector in (('a', '5.431, 0.0, 0.0'), ('b', '0.0, 5.431, 0.0'),
+                         ('c', '0.0, 0.0, 5.431')):
+        lines.append(' Lattice vector %s: %s\n' % (name, vector))
+    lines.append('\n SIMULATION RESULTS\n\n Yield moments:\n')
+    for kind in ('Backscattered', 'Transmitted', 'Stopped'):
+        lines.append('   %s atoms per ion:\n' % kind)
+        # the fields split at '|' are empty, label, column 1, ..., column 
+        # ncolumns (see read_output.read_out)
+        lines.append(' |           ' + ''.join('|  atom %2d   ' % (i+1) 
+                                               for i in range(ncolumns)) 
+                     + '\n')
+        for moment in ('mean value', 'std.dev.', 'skewness', 'kurtosis'):
+            for label in (moment, '+/-'):
+                lines.append(' | %-10s' % label + ''.join(
+                    '| %10.4E ' % rng.random() for __ in range(ncolumns)) 
+                    + '\n')
+    with open(fname, 'w') as f:
+        f.writelines(lines)
+    return len(lines)
+
+
+def write_tra(fname, size=10**7, max_generation=6, seed=0):
+    """
+    Write a trajectory file of about size bytes with cascades of recoils up to 
+    generation max_generation, including virtual recoils.
+    """
+    rng = random.Random(seed)
+    lines = []
+    
+    def point(i1, ig, iflag, z):
+        lines.append('%14.6E%14.6E%14.6E%11.6F%11.6F%11.6F%14.6E%4d%4d%3d\n' 
+                     % (rng.gauss(0., 50.), rng.gauss(0., 50.), z,
+                        rng.uniform(-1., 1.), rng.uniform(-1., 1.), 
+                        rng.uniform(-1., 1.), rng.uniform(1., 1e4),
+                        i1, ig, iflag))
+    
+    def trajectory(i1, ig, z):
+        for __ in range(rng.randint(1, 10)):
+            z += rng.uniform(0., 20.)
+            if ig < max_generation and rng.random() < 0.3:
+                species = rng.randint(2, 3)
+                if rng.random() < 0.1:
+                    # subthreshold recoil
+                    point(species, ig+1, 0, z)
+                else:
+                    point(species, ig+1, 1, z)
+                    trajectory(species, ig+1, z)
+                    if rng.random() < 0.1:
+                        # trajectory turning virtual
+                        point(-i1, ig+1, 3, z)
+                        point(i1, ig, 2, z)
+            point(i1, ig, 2, z)
+        point(i1, ig, rng.choice((3, 3, 3, 4, 5)), z)
+    
+    npoints = 0
+    nbytes = 0
+    with open(fname, 'w') as f:
+        while nbytes < size:
+            point(1, 1, 1, 0.)
+            trajectory(1, 1, 0.)
+            npoints += len(lines)
+            nbytes += sum(len(line) for line in lines)
+            f.writelines(lines)
+            lines.clear()
+    return npoints
+
+
+def generate(directory, size):
+    """
+    Write synthetic files of about size bytes each to directory. Returns a 
+    dictionary mapping the file types to (file name, number of items).
+    """
+    files = {}
+    name = os.path.join(directory, 'bench.his')
+    npoints = max(2, size // (4*15*3))
+    files['his'] = name, write_his(name, nrecords=2, ncolumns=3, 
+                                   npoints=npoints)
+    name = os.path.join(directory, 'bench.his2')
+    n = max(2, int(np.sqrt(size / (8*2*2))))
+    files['his2'] = name, write_his2(name, nrecords=2, natoms=2, nz=n, nx=n)
+    name = os.path.join(directory, 'bench.his3')
+    n = max(2, int(np.cbrt(size / (8*2*2))))
+    files['his3'] = name, write_his3(name, nrecords=2, natoms=2, 
+                                     nx=n, ny=n, nz=n)
+    name = os.path.join(directory, 'bench.out')
+    files['out'] = name, write_out(name, nlines=size // 30)
+    name = os.path.join(directory, 'bench.tra')
+    files['tra'] = name, write_tra(name, size=size)
+    return files
+
+
+def _read_his(fname):
+    for record in (1, 2):
+        for column in (1, 2, 3):
+            read_output.read_his(fname, record, column)
+
+
+def _read_his2(fname):
+    for rec in (1, 2):
+        for atom in (1, 2):
+            np.sum(read_output.read_his2(fname, rec, atom)[2])
+
+
+def _read_his3(fname):
+    for rec in (1, 2):
+        for atom in (1, 2):
+            np.sum(read_output.read_his3(fname, rec, atom)[3])
+
+
+def _pyramids(fname):
+    # the lateral axis of the synthetic .his2 files is centred on the origin
+    for rec in (1, 2):
+        for atom in (1, 2):
+            x, z, hist, __ = read_output.read_his2(fname, rec, atom)
+            read_output.rebin_pyramid(hist, (z, x))
+            edges = np.concatenate(([1.5*x[0] - 0.5*x[1]], (x[:-1] + x[1:])/2, 
+                                    [1.5*x[-1] - 0.5*x[-2]]))
+            profile = np.concatenate(((0.,), np.repeat(hist.sum(axis=0), 2), 
+                                      (0.,)))
+            read_output.merge_pyramid(np.repeat(edges, 2), profile)
+
+
+def _read_out(fname):
+    for column in (1, 2, 3):
+        read_output.read_out(fname, ('Yield moments', 'Backscattered', 
+                                     'mean'), column)
+        read_output.read_out(fname, ('Yield moments', 'Backscattered', 
+                                     'mean', '+/-'), column)
+    read_output.extract_yield(fname, 1, backward=False)
+    read_output.extract_lattice(fname)
+
+
+def _read_trajectories(fname):
+    read_output.read_trajectories(fname, 1, -1, index=False)
+
+
+def _read_trajectory_arrays(fname):
+    read_output.read_trajectory_arrays(fname, 1, -1, index=False)
+
+
+def _iter_cascades(fname):
+    for __ in read_output.iter_cascades(fname):
+        pass
+
+
+# name of benchmark, file type, function
+BENCHMARKS = (('read_his', 'his', _read_his),
+              ('read_his2', 'his2', _read_his2),
+              ('read_his3', 'his3', _read_his3),
+              ('pyramids', 'his2', _pyramids),
+              ('read_out', 'out', _read_out),
+              ('read_trajectories', 'tra', _read_trajectories),
+              ('read_trajectory_arrays', 'tra', _read_trajectory_arrays),
+              ('iter_cascades', 'tra', _iter_cascades))
+
+
+def _max_rss():
+    """
+    Return the maximum resident set size of the current process in bytes.
+    """
+    # on Linux, ru_maxrss may be inherited from the parent process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _peak_memory(func, fname):
+    """
+    Return the increase of the maximum resident set size of the current 
+    process in bytes during the call func(fname).
+    """
+    before = _max_rss()
+    func(fname)
+    return _max_rss() - before
+
+
+def measure(func, fname, repeat=3):
+    """
+    Return the best time of repeat calls of func(fname) and the peak memory 
+    used by a separate call in a fresh process (see _peak_memory). Caches of 
+    read_output are cleared before each timed call.
+    """
+    best = float('inf')
+    for __ in range(repeat):
+        read_output.clear_caches()
+        start = time.perf_counter()
+        func(fname)
+        best = min(best, time.perf_counter() - start)
+    
+    with ProcessPoolExecutor(
+            max_workers=1, 
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        peak = executor.submit(_peak_memory, func, fname).result()
+    return best, peak
+
+
+def run(directory, size, repeat=3, benchmarks=BENCHMARKS):
+    """
+    Generate the synthetic files and run the benchmarks. Returns a list of 
+    (name, file size, time, peak memory, number of items).
+    """
+    files = generate(directory, size)
+    results = []
+    for name, kind, func in benchmarks:
+        fname, nitems = files[kind]
+        duration, peak = measure(func, fname, repeat)
+        results.append((name, os.path.getsize(fname), duration, peak, nitems))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=float, default=10., 
+                        help='approximate size of each file in MB')
+    parser.add_argument('--repeat', type=int, default=3, 
+                        help='number of timed runs per reader')
+    parser.add_argument('--dir', help='directory for the synthetic files')
+    args = parser.parse_args()
+    
+    size = int(args.size * 1e6)
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+        results = run(args.dir, size, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(directory, size, args.repeat)
+    
+    print('%-24s %9s %9s %9s %12s %9s' % ('reader', 'size[MB]', 'time[s]', 
+                                         'MB/s', 'items/s', 'peak[MB]'))
+    for name, nbytes, duration, peak, nitems in results:
+        print('%-24s %9.2f %9.3f %9.1f %12.4g %9.1f' 
+              % (name, nbytes/1e6, duration, nbytes/1e6/duration, 
+                 nitems/duration, peak/1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+"""
+Follow the output files of running IMSIL simulations.
+
+Usage:
+
+     python follow.py <filename> [interval]
+
+prints the number of new cascades of the trajectory (.tra) file or of new
+records of the 1D histogram (.his*) file <filename> whenever the file grows,
+polling every interval seconds (default 1).
+
+The followers remember the position up to which a file has been read and parse
+only the data appended since then. A partial last line is kept until it is
+completed. The last cascade of a trajectory file is only returned when the
+next cascade starts or the follower is flushed at the end of the simulation.
+If a file shrinks, it is assumed to be rewritten and is read from the start.
+"""
+import os, sys, time
+import numpy as np
+from read_output import (HIS_EXTS, TRA_DTYPE, TrajectoryArrays, 
+                         _cascade_starts, _parse_his_lines, _parse_tra_bytes, 
+                         is_compressed, output_ext)
+
+
+class _Follower:
+    """
+    Base class of the followers, reading the bytes appended to a file.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.offset = 0         # number of bytes read
+        self.rest = b''         # partial last line
+
+    def _reset(self):
+        self.offset = 0
+        self.rest = b''
+
+    def _read_lines(self):
+        """
+        Return the complete lines appended since the last call as bytes.
+        """
+        try:
+            size = os.path.getsize(self.fname)
+        except OSError:
+            return b''
+        if size < self.offset:
+            self._reset()
+        if size == self.offset:
+            return b''
+        with open(self.fname, 'rb') as f:
+            f.seek(self.offset)
+            data = self.rest + f.read(size - self.offset)
+        self.offset = size
+        end = data.rfind(b'\n') + 1
+        self.rest = data[end:]
+        return data[:end]
+
+    def watch(self, callback, interval=1., idle=None):
+        """
+        Poll the file every interval seconds and call callback with the new
+        data (see poll) whenever there are any. Returns when callback returns
+        False or when there have been no new data for idle seconds (None
+        means never); the remaining data are then flushed to callback.
+        """
+        last = time.monotonic()
+        while True:
+            new = self.poll()
+            if len(new):
+                last = time.monotonic()
+                if callback(new) is False:
+                    return
+            elif idle is not None and time.monotonic() - last > idle:
+                break
+            time.sleep(interval)
+        new = self.flush()
+        if len(new):
+            callback(new)
+
+
+class TraFollower(_Follower):
+    """
+    Follower of a tra file returning new complete cascades as TrajectoryArrays.
+
+    ncasc: number of cascades returned so far
+    """
+    def __init__(self, fname):
+        super().__init__(fname)
+        self.ncasc = 0
+        self.pending = np.zeros(0, dtype=TRA_DTYPE)     # current cascade
+
+    def _reset(self):
+        super()._reset()
+        self.ncasc = 0
+        self.pending = np.zeros(0, dtype=TRA_DTYPE)
+
+    def poll(self):
+        """
+        Return the cascades completed since the last call.
+        """
+        points = _parse_tra_bytes(self._read_lines())
+        if len(points):
+            points = np.concatenate((self.pending, points))
+            starts = np.flatnonzero(_cascade_starts(points))
+            last = starts[-1] if len(starts) else 0
+            complete, self.pending = points[:last], points[last:]
+        else:
+            complete = points
+        return self._cascades(complete)
+
+    def flush(self):
+        """
+        Return the current cascade, assuming that the file is complete.
+        """
+        points = _parse_tra_bytes(self.rest)
+        self.rest = b''
+        complete = np.concatenate((self.pending, points))
+        self.pending = np.zeros(0, dtype=TRA_DTYPE)
+        return self._cascades(complete)
+
+    def _cascades(self, points):
+        cascades = TrajectoryArrays(points)
+        self.ncasc += len(cascades)
+        return cascades
+
+
+class HisFollower(_Follower):
+    """
+    Follower of a 1D his file returning new complete records as a list of 2D
+    arrays (see read_his_all).
+
+    nrecords: number of records returned so far
+    """
+    def __init__(self, fname):
+        super().__init__(fname)
+        self.nrecords = 0
+        self.lines = []     # lines of the current record
+
+    def _reset(self):
+        super()._reset()
+        self.nrecords = 0
+        self.lines = []
+
+    def poll(self):
+        """
+        Return the records completed since the last call.
+        """
+        data = self._read_lines()
+        if data:
+            self.lines += data.decode('utf-8', errors='replace').splitlines(
+                True)
+        records, nlines = _parse_his_lines(self.lines, partial=True)
+        del self.lines[:nlines]
+        self.nrecords += len(records)
+        return records
+
+    def flush(self):
+        """
+        Return the current record, assuming that the file is complete.
+        """
+        if self.rest:
+            self.lines.append(self.rest.decode('utf-8', errors='replace'))
+            self.rest = b''
+        records, __ = _parse_his_lines(self.lines)
+        self.lines = []
+        self.nrecords += len(records)
+        return records
+
+
+def follower(fname):
+    """
+    Return the follower of a tra or 1D his file.
+    """
+    if is_compressed(fname):
+        raise ValueError('Cannot follow compressed file ' + fname)
+    ext = output_ext(fname)
+    if ext == '.tra':
+        return TraFollower(fname)
+    elif ext in HIS_EXTS:
+        return HisFollower(fname)
+    raise ValueError('Cannot follow files with extension ' + ext)
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        sys.exit('Usage: python ' + __file__ + ' filename [interval]')
+
+    f = follower(sys.argv[1])
+    interval = float(sys.argv[2]) if len(sys.argv) == 3 else 1.
+    name = 'cascades' if isinstance(f, TraFollower) else 'records'
+    def report(new):
+        print(len(new), 'new', name)
+    try:
+        f.watch(report, interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
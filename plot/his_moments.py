@@ -0,0 +1,164 @@
+#! /usr/bin/env python3
+"""
+Moments of the distributions of 1D histogram (.his*) files.
+
+Usage:
+
+     python his_moments.py <filename> [<filename> ...]
+
+prints the total, projected range, straggling, skewness and kurtosis of every
+atom species and record of the histogram files.
+
+A histogram is a curve through the points (x, hist) of a record, which is
+integrated exactly assuming that hist is linear between the points. This
+covers the step functions written by IMSIL, where boxes are represented by
+pairs of points. All columns of a record are processed at once; each file is
+read once (see read_output.read_his_all), and many files are processed in a
+process pool.
+"""
+import os, sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from read_output import read_his_all
+
+
+def moments_dtype(max_order=4):
+    """
+    Return the data type of the rows of the moments table: file index, record
+    and column (from 1), total, range (mean value), straggle (standard
+    deviation), skewness, kurtosis, and the central moments of orders 0 to
+    max_order (order 0 being 1 and order 1 being 0).
+    """
+    return np.dtype([('file', 'i4'), ('record', 'i4'), ('column', 'i4'),
+                     ('total', 'f8'), ('range', 'f8'), ('straggle', 'f8'),
+                     ('skewness', 'f8'), ('kurtosis', 'f8'),
+                     ('moments', 'f8', (max_order+1,))])
+
+
+def central_moments(x, hist, max_order=4):
+    """
+    Return the total and the mean value of the distributions hist(x) and their
+    central moments of orders 0 to max_order, normalized to the total.
+
+    x:    abscissas, shape (npoints,)
+    hist: values, shape (npoints,) or (npoints, ncolumns)
+
+    The moments are returned as an array (max_order+1, ncolumns) (or
+    (max_order+1,) for one-dimensional hist).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    hist = np.asarray(hist, dtype=np.float64)
+    one_column = hist.ndim == 1
+    if one_column:
+        hist = hist[:, None]
+
+    # Gauss-Legendre quadrature, exact for polynomials of degree max_order+1
+    nodes, weights = np.polynomial.legendre.leggauss((max_order+3) // 2)
+    t = (nodes + 1) / 2                                 # (nq,)
+    a, b = x[:-1], x[1:]
+    width = (b - a)[:, None] * weights / 2              # (nseg, nq)
+    xq = a[:, None] + (b - a)[:, None] * t              # (nseg, nq)
+    yq = (hist[:-1, None, :] * (1 - t)[:, None] +
+          hist[1:, None, :] * t[:, None])               # (nseg, nq, ncol)
+    wy = width[:, :, None] * yq
+
+    total = wy.sum(axis=(0, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.einsum('sq,sqc->c', xq, wy) / total
+        dx = xq[:, :, None] - mean
+        moments = np.empty((max_order+1, hist.shape[1]))
+        power = np.ones_like(dx)
+        for k in range(max_order+1):
+            moments[k] = (power * wy).sum(axis=(0, 1)) / total
+            power *= dx
+
+    if one_column:
+        return total[0], mean[0], moments[:, 0]
+    return total, mean, moments
+
+
+def his_moments(fname, max_order=4, ifile=0):
+    """
+    Return the moments table (see moments_dtype) with one row per record and
+    atom species of a his file.
+
+    ifile: value of the 'file' field
+    """
+    max_order = max(max_order, 4)
+    rows = []
+    for record, data in enumerate(read_his_all(fname), 1):
+        ncolumns = data.shape[1] - 1
+        table = np.zeros(ncolumns, dtype=moments_dtype(max_order))
+        table['file'] = ifile
+        table['record'] = record
+        table['column'] = np.arange(1, ncolumns+1)
+        if len(data) > 1:
+            total, mean, moments = central_moments(data[:, 0], data[:, 1:],
+                                                   max_order)
+        else:
+            total = np.zeros(ncolumns)
+            mean = np.full(ncolumns, np.nan)
+            moments = np.full((max_order+1, ncolumns), np.nan)
+        table['total'] = total
+        table['range'] = mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            straggle = np.sqrt(moments[2])
+            table['straggle'] = straggle
+            table['skewness'] = moments[3] / straggle**3
+            table['kurtosis'] = moments[4] / straggle**4
+        table['moments'] = moments.T
+        rows.append(table)
+    if not rows:
+        return np.zeros(0, dtype=moments_dtype(max_order))
+    return np.concatenate(rows)
+
+
+def _his_moments_job(job):
+    fname, max_order, ifile = job
+    try:
+        return his_moments(fname, max_order, ifile)
+    except (OSError, ValueError, IndexError) as err:
+        print('Could not read', fname + ':', err)
+        return np.zeros(0, dtype=moments_dtype(max(max_order, 4)))
+
+
+def batch_moments(fnames, max_order=4, workers=None):
+    """
+    Return the moments table (see moments_dtype) of many his files, processed
+    in a process pool. The 'file' field is the index into fnames. Files that
+    cannot be read are reported and skipped.
+
+    workers: number of worker processes; None means the number of CPUs
+    """
+    jobs = [(fname, max_order, i) for i, fname in enumerate(fnames)]
+    if workers == 1 or len(jobs) <= 1:
+        tables = [_his_moments_job(job) for job in jobs]
+    else:
+        nworkers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(
+                _his_moments_job, jobs,
+                chunksize=max(1, len(jobs) // (4*nworkers))))
+    if not tables:
+        return np.zeros(0, dtype=moments_dtype(max(max_order, 4)))
+    return np.concatenate(tables)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python ' + __file__ + ' filename [filename ...]')
+
+    fnames = sys.argv[1:]
+    table = batch_moments(fnames)
+    print('%-30s %6s %6s %12s %12s %12s %12s %12s'
+          % ('file', 'record', 'column', 'total', 'range', 'straggle',
+             'skewness', 'kurtosis'))
+    for row in table:
+        print('%-30s %6d %6d %12.5g %12.5g %12.5g %12.5g %12.5g'
+              % ((fnames[row['file']], row['record'], row['column'])
+                 + tuple(row[name] for name in ('total', 'range', 'straggle',
+                                                'skewness', 'kurtosis'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,19 @@ mainly meant to be called from other modules, but can also be used as a script
        
      python read_output.px <filename>
        
-to do best-guess processing with the IMSIL output file <filename>.
+to do best-guess processing with the IMSIL output file <filename>, as
+
+     python read_output.py list <filename>
+
+to list the records of a histogram file, as
+
+     python read_output.py slices <filename>.his3 [atom] [record]
+
+to show slices of a 3D histogram with matplotlib instead of mayavi, or as
+
+     python read_output.py convert <filename>.tra [--compress]
+
+to convert a trajectory file into a binary trajectory (.trb) file.
 
 Supported functionalities:
 
@@ -16,15 +28,78 @@ Supported functionalities:
 * Read the value of a parameter from an input (.inp) file
 * Read a calculated quantity from an output (.out) file
 * Read a histogram from a 1D histogram (.his*) file
+* Combine 1D histograms with different abscissas
+* Merge the boxes of 1D, 2D and 3D histograms, also for several resolutions
 * Read a histogram from a 2D histogram (.his*2) file
+* Read a histogram from a 3D histogram (.his*3) file
+* List the records of a histogram file without reading the histograms
+* Store mostly empty 2D and 3D histograms sparsely
+* Crop and downsample a 3D histogram without loading the full volume
+* Show slices and projections of a 3D histogram with matplotlib
 * Read a collision cascade from a trajectory (.tra) file
+* Read collision cascades from a trajectory (.tra) file into NumPy arrays
+* Index the cascades of a trajectory (.tra) file for random access
+* Iterate over the cascades of a trajectory (.tra) file with bounded memory
+* Read a random sample of the cascades of a trajectory (.tra) file
+* Plot collision cascades as line collections
+* Convert a trajectory (.tra) file into a memory-mappable binary (.trb) file
 
-Note that there are restriction on reading .his*2 files due to the FortranFile 
-module.
+.his*2 and .his*3 files are accessed through a catalog of their Fortran records 
+and memory maps (see HisCatalog).
+
+All files may be compressed with gzip (.gz), bzip2 (.bz2) or xz (.xz); they are 
+then decompressed while reading (see open_output).
 """
-import os, sys
+import bz2, gzip, hashlib, io, json, lzma, os, shutil, struct, sys, tempfile
+import zipfile, zlib
+from bisect import bisect_right
+from itertools import islice
 import numpy as np
-from scipy.io import FortranFile
+
+
+# maximum number of files kept in each of the caches of parsed files
+CACHE_SIZE = 16
+
+# functions opening the files compressed with the respective extensions
+COMPRESSORS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# extensions of 1D, 2D and 3D histogram files
+HIS_EXTS = ('.his', '.hisee', '.hisne', '.hise', 
+            '.hisb', '.hiseb', '.hisab', '.hisaab',
+            '.hist', '.hiset', '.hisat', '.hisaat')
+HIS2_EXTS = ('.his2', '.hisee2', '.hisne2', '.hise2', 
+             '.his2b', '.hisa2b', '.hisa2t')
+HIS3_EXTS = ('.his3', '.hisee3', '.hisne3')
+
+
+def is_compressed(fname):
+    """
+    Return True if fname has the extension of a compressed file (see 
+    COMPRESSORS).
+    """
+    return os.path.splitext(fname)[1] in COMPRESSORS
+
+
+def output_ext(fname):
+    """
+    Return the extension of an output file, ignoring the extension of a 
+    compressed file (e.g. '.his' for 'name.his.gz').
+    """
+    root, ext = os.path.splitext(fname)
+    if ext in COMPRESSORS:
+        ext = os.path.splitext(root)[1]
+    return ext
+
+
+def open_output(fname, mode='r'):
+    """
+    Open an output file, decompressing it while reading if it is compressed 
+    (see COMPRESSORS). mode is 'r' for text and 'rb' for binary mode.
+    """
+    ext = os.path.splitext(fname)[1]
+    if ext in COMPRESSORS:
+        return COMPRESSORS[ext](fname, 'rt' if mode == 'r' else mode)
+    return open(fname, mode)
 
 
 def read_par(fname, key=None):
@@ -35,7 +110,7 @@ def read_par(fname, key=None):
     key: name of the parameter
     """
 
-    with open(fname) as f:
+    with open_output(fname) as f:
         line = f.readline()
         f.seek(0)
     
@@ -52,8 +127,9 @@ def read_par(fname, key=None):
         else:
             from collections import OrderedDict
             param = OrderedDict()
+            params = []
             parString = f.read()
-            if parString.stript().startswith( 'def ' ):
+            if parString.strip().startswith( 'def ' ):
                 from types import FunctionType
                 fun_code = compile( parString, '<string>', 'exec' )
                 get_params = FunctionType( fun_code.co_consts[0], globals(), 'get_params')
@@ -81,7 +157,7 @@ def read_inp(fname, key):
     
     params = []
     
-    with open(fname) as f:
+    with open_output(fname) as f:
         string = f.read()
         items = string.split()
         for item in items:
@@ -91,6 +167,108 @@ def read_inp(fname, key):
     return params
 
 
+class OutFile:
+    """
+    Contents of an out file, parsed in one pass.
+    
+    lines:   lines of the file
+    yields:  dictionary mapping the kind of yield ('Backscattered', 
+             'Transmitted', ...) in the yield moments to the fields of its 
+             'mean value' and '+/-' lines, split at '|'
+    lattice: crystal system and lattice vectors a, b, c (None if not present)
+    
+    Search string chains as used by read_out are looked up in an index of the 
+    lines and cached.
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.yields = {}
+        self.lattice = None
+        self._positions = {}
+        self._chains = {}
+        
+        crystal_system = a = b = c = None
+        in_yields = False
+        pending = {}    # kinds of yields waiting for 'mean value' or '+/-'
+        for line in lines:
+            if 'crystal system' in line:
+                items = line.split(',')
+                for item in items:
+                    param, __, value = item.partition('=')
+                    if 'crystal system' in param:
+                        crystal_system = value
+            elif 'Lattice vector a' in line:
+                a = eval(line.split(':')[1])
+            elif 'Lattice vector b' in line:
+                b = eval(line.split(':')[1])
+            elif 'Lattice vector c' in line:
+                c = eval(line.split(':')[1])
+            
+            if 'Yield moments:' in line:
+                in_yields = True
+            elif in_yields and ' atoms per ion:' in line:
+                kind = line.split(' atoms per ion:')[0].split()[-1]
+                if kind not in self.yields:
+                    self.yields[kind] = None
+                    pending[kind] = 'mean value'
+            if 'mean value' in line or '+/-' in line:
+                for kind, wanted in list(pending.items()):
+                    if wanted == 'mean value' and 'mean value' in line:
+                        self.yields[kind] = (line.split('|'),)
+                        pending[kind] = '+/-'
+                    elif wanted == '+/-' and '+/-' in line:
+                        self.yields[kind] += (line.split('|'),)
+                        del pending[kind]
+        
+        if crystal_system is not None:
+            self.lattice = crystal_system, a, b, c
+    
+    def find(self, search_strings):
+        """
+        Return the number of the line found by searching for the search strings 
+        consecutively (see read_out).
+        """
+        key = tuple(search_strings)
+        if key not in self._chains:
+            i = -1
+            for search_string in search_strings:
+                if search_string not in self._positions:
+                    self._positions[search_string] = [
+                        j for j, line in enumerate(self.lines) 
+                        if search_string in line]
+                positions = self._positions[search_string]
+                k = bisect_right(positions, i)
+                if k == len(positions):
+                    raise ValueError('"' + '", "'.join(search_strings) + 
+                                     '" not found')
+                i = positions[k]
+            self._chains[key] = i
+        return self._chains[key]
+
+
+_out_files = {}
+
+
+def parse_out(fname):
+    """
+    Parse an out file and return an OutFile object. The result is cached 
+    based on a hash of the file contents and must not be modified. Only the 
+    CACHE_SIZE most recently used files are kept.
+    """
+    with open_output(fname, 'rb') as f:
+        contents = f.read()
+    key = hashlib.sha1(contents).hexdigest()
+    if key in _out_files:
+        out_file = _out_files.pop(key)
+    else:
+        lines = contents.decode('utf-8', errors='replace').splitlines(True)
+        out_file = OutFile(lines)
+    _out_files[key] = out_file
+    while len(_out_files) > CACHE_SIZE:
+        del _out_files[next(iter(_out_files))]
+    return out_file
+
+
 def read_out(fname, search_strings, column=1):
     """
     Read output parameter from an out file.
@@ -103,12 +281,8 @@ def read_out(fname, search_strings, column=1):
                     often: column=1...ion, column=2...first target atom
     """
     
-    with open(fname) as f:
-        for search_string in search_strings:
-            while True:
-                line = f.readline()
-                if search_string in line:
-                    break
+    out = parse_out(fname)
+    line = out.lines[out.find(search_strings)]
 
     value = line.split('|')[column+1]
     try:
@@ -133,27 +307,8 @@ def extract_yield(fname, column=1, backward=True):
     else:
         kind = 'Transmitted'
 
-    with open(fname) as f:
-        while True:
-            line = f.readline()
-            if 'Yield moments:' in line:
-                break
-        while True:
-            line = f.readline()
-            if kind + ' atoms per ion:' in line:
-                break
-        while True:
-            line = f.readline()
-            if 'mean value' in line:
-                syield = line.split('|')[column+1]
-                break
-        while True:
-            line = f.readline()
-            if '+/-' in line:
-                dyield = line.split('|')[column+1]
-                break
-
-    return syield, dyield
+    mean, error = parse_out(fname).yields[kind]
+    return mean[column+1], error[column+1]
 
 
 def extract_lattice(fname):
@@ -163,22 +318,59 @@ def extract_lattice(fname):
     fname:  name of .out file
     """
 
-    with open(fname) as f:
-        for line in f:
-            if 'crystal system' in line:
-                items = line.split(',')
-                for item in items:
-                    param, value = item.split('=')
-                    if 'crystal system' in param:
-                        crystal_system = value
-            elif 'Lattice vector a' in line:
-                a = eval(line.split(':')[1])
-            elif 'Lattice vector b' in line:
-                b = eval(line.split(':')[1])
-            elif 'Lattice vector c' in line:
-                c = eval(line.split(':')[1])
+    lattice = parse_out(fname).lattice
+    if lattice is None:
+        raise ValueError('No crystal system in ' + fname)
+    return lattice
+
+
+def unify_hists(histograms):
+    """
+    Define several histograms on the union of their box boundaries.
+    
+    histograms: sequence of histograms (x, y) in the format returned by 
+                read_his, i.e., each box boundary appears twice in x, and y 
+                contains the values left and right of each boundary
+    
+    Returns the unified abscissas and a 2D array with one row of unified values 
+    per histogram. The input arrays are not modified.
+    """
+    bounds = [np.asarray(x, dtype=float)[0::2] for x, __ in histograms]
+    # value left of the first boundary, box values, value right of the last 
+    # boundary
+    values = [np.append(np.asarray(y)[0::2], y[-1]) for __, y in histograms]
+    
+    # number of boundaries of each histogram up to each unified boundary
+    x_unified = np.unique(np.concatenate(bounds))
+    nhist = len(histograms)
+    hist_id = np.repeat(np.arange(nhist), [len(b) for b in bounds])
+    counts = np.zeros((nhist, len(x_unified)), dtype=np.intp)
+    np.add.at(counts, (hist_id, np.searchsorted(x_unified, 
+                                                np.concatenate(bounds))), 1)
     
-    return crystal_system, a, b, c
+    # values right of each unified boundary
+    offsets = np.cumsum([0] + [len(v) for v in values[:-1]])
+    right = np.concatenate(values)[offsets[:,None] + np.cumsum(counts, axis=1)]
+    
+    y_unified = np.empty((nhist, 2*len(x_unified)))
+    y_unified[:,0] = [v[0] for v in values]
+    y_unified[:,2::2] = right[:,:-1]
+    y_unified[:,1::2] = right
+    return np.repeat(x_unified, 2), y_unified
+
+
+def combine_his(histograms, weights=None):
+    """
+    Take the linear combination of several histograms with potentially 
+    different abscissas. The result is defined on the union of the abscissas.
+    
+    histograms: sequence of histograms (x, y) (see unify_hists)
+    weights:    factors of the histograms; None means 1 for all histograms
+    """
+    x_unified, y_unified = unify_hists(histograms)
+    if weights is None:
+        return x_unified, np.sum(y_unified, axis=0)
+    return x_unified, np.asarray(weights, dtype=float) @ y_unified
 
 
 def unify_his(x1, y1, x2, y2):
@@ -191,22 +383,8 @@ def unify_his(x1, y1, x2, y2):
     y2: values of second histogram
     """
     
-    eps = 1e-6*max(np.max(x1), np.max(x2))
-    #print x1
-    x1tmp = x1
-    x1tmp[1::2] += eps
-    x2tmp = x2
-    x2tmp[1::2] += eps
-    #print x1
-    x_unified = list(set(x1tmp)|set(x2tmp))
-    x_unified.sort()
-    x_unified = np.array(x_unified)
-    y1_unified = np.interp(x_unified, x1tmp, y1)
-    y2_unified = np.interp(x_unified, x2tmp, y2)
-    #print x_unified
-    x_unified[1::2] = x_unified[:-1:2]
-    #print x_unified
-    return x_unified, y1_unified, y2_unified    
+    x_unified, y_unified = unify_hists(((x1, y1), (x2, y2)))
+    return x_unified, y_unified[0], y_unified[1]
 
 
 def add_his(x1, y1, x2, y2, fac1=1, fac2=1):
@@ -222,8 +400,18 @@ def add_his(x1, y1, x2, y2, fac1=1, fac2=1):
     fac2: factor for y2
     """
 
-    x_unified, y1_unified, y2_unified = unify_his(x1, y1, x2, y2)
-    return x_unified, fac1*y1_unified + fac2*y2_unified
+    return combine_his(((x1, y1), (x2, y2)), (fac1, fac2))
+
+
+def _merge_padding(boundaries, n_merge):
+    """
+    Return the numbers of boxes to be added to the left and to the right such 
+    that there are multiples of n_merge boxes to the left and to the right of 
+    the box boundary closest to the origin.
+    """
+    n = len(boundaries) - 1
+    i = np.argmin(abs(boundaries))
+    return -i % n_merge, -(n-i) % n_merge
 
 
 def merge_boxes(xx, hist, n_merge):
@@ -244,17 +432,14 @@ def merge_boxes(xx, hist, n_merge):
     
     # search for position closest to the origin and expand arrays such that 
     # there are multiples of n_merge boxes to the left and right of the origin
-    n = len(x) - 1
-    i = np.argmin(abs(x))
-    nadd_left = -i % n_merge
-    nadd_right = -(n-i) % n_merge
+    nadd_left, nadd_right = _merge_padding(x, n_merge)
     x = np.concatenate((x[0]-(np.arange(nadd_left)[::-1]+1)*(x[1]-x[0]), x,
                         x[-1]+(np.arange(nadd_right)+1)*(x[-1]-x[-2])))
     h = np.concatenate((np.zeros(nadd_left), h, np.zeros(nadd_right)))
     
     # merge boxes
     x = x[::n_merge]
-    h = np.array([np.mean(h[i:i+n_merge]) for i in range(0,len(h),n_merge)])
+    h = h.reshape((-1, n_merge)).mean(axis=1)
     
     # reconstruct his format
     x = np.vstack((x, x)).T.flatten()
@@ -262,7 +447,187 @@ def merge_boxes(xx, hist, n_merge):
     h = np.concatenate(((hist[0],), h, (hist[-1],)))
     
     return x, h
+
+
+def merge_pyramid(xx, hist, max_merge=None):
+    """
+    Merge the boxes of the histogram (xx, hist) repeatedly by factors of 2 
+    (see merge_boxes). Returns a dictionary mapping the total number of merged 
+    boxes (1, 2, 4, ...) to the merged histogram (x, hist).
+    
+    max_merge: maximum number of merged boxes; None means as long as merging 
+               reduces the number of boxes, i.e., until there is only one box 
+               left or one box on either side of the origin
+    """
+    pyramid = {1: (xx, hist)}
+    n_merge = 1
+    while len(xx) > 4 and (max_merge is None or 2*n_merge <= max_merge):
+        merged = merge_boxes(xx, hist, 2)
+        if len(merged[0]) >= len(xx):
+            # padding around the origin compensates the merging
+            break
+        xx, hist = merged
+        n_merge *= 2
+        pyramid[n_merge] = xx, hist
+    return pyramid
+
+
+def rebin(hist, n_merge, axes=None):
+    """
+    Merge n_merge boxes along each dimension of a histogram such that the box 
+    boundary closest to the origin is maintained. The histogram is padded with 
+    zeros where necessary, and the merged values are the mean values.
+    
+    hist:    histogram of any dimension, e.g., hist(z,x) returned by read_his2 
+             or hist(z,y,x) returned by read_his3
+    n_merge: number of boxes to be merged, either an integer or a sequence 
+             with one value per dimension
+    axes:    sequence of the box centers along each dimension, e.g., (z, x) for 
+             hist(z,x); None means that the boxes are merged starting at 
+             index 0
+    
+    Returns the merged histogram and the sequence of merged box centers (None 
+    if axes is None).
+    """
+    hist = np.asarray(hist)
+    n_merge = np.broadcast_to(n_merge, (hist.ndim,))
+    pad = []
+    new_axes = []
+    for dim, n in enumerate(n_merge):
+        size = hist.shape[dim]
+        if axes is None:
+            pad.append((0, -size % n))
+            continue
+        centers = np.asarray(axes[dim], dtype=float)
+        if size > 1:
+            dleft = centers[1] - centers[0]
+            dright = centers[-1] - centers[-2]
+        else:
+            dleft = dright = 1.
+        boundaries = np.concatenate(([centers[0] - dleft/2], 
+                                     (centers[:-1] + centers[1:])/2, 
+                                     [centers[-1] + dright/2]))
+        nadd_left, nadd_right = _merge_padding(boundaries, n)
+        pad.append((nadd_left, nadd_right))
+        centers = np.concatenate((
+            centers[0] - (np.arange(nadd_left)[::-1]+1)*dleft, centers, 
+            centers[-1] + (np.arange(nadd_right)+1)*dright))
+        new_axes.append(centers.reshape((-1, n)).mean(axis=1))
+    
+    if any(p != (0, 0) for p in pad):
+        hist = np.pad(hist, pad)
+    shape = []
+    for dim, n in enumerate(n_merge):
+        shape += [hist.shape[dim] // n, n]
+    hist = hist.reshape(shape).mean(axis=tuple(range(1, 2*hist.ndim, 2)))
+    
+    if axes is None:
+        return hist, None
+    return hist, tuple(new_axes)
+
+
+def rebin_pyramid(hist, axes=None, max_merge=None):
+    """
+    Merge the boxes of a histogram repeatedly by factors of 2 along all 
+    dimensions (see rebin). Returns a dictionary mapping the total number of 
+    merged boxes per dimension (1, 2, 4, ...) to the merged histogram and box 
+    centers (hist, axes).
+    
+    max_merge: maximum number of merged boxes; None means as long as all 
+               dimensions have at least two boxes and merging reduces the 
+               number of boxes along some dimension
+    """
+    pyramid = {1: (hist, axes)}
+    n_merge = 1
+    while min(np.shape(hist)) >= 2 and (max_merge is None or 
+                                        2*n_merge <= max_merge):
+        merged = rebin(hist, 2, axes)
+        if np.shape(merged[0]) == np.shape(hist):
+            # padding around the origin compensates the merging
+            break
+        hist, axes = merged
+        n_merge *= 2
+        pyramid[n_merge] = hist, axes
+    return pyramid
+
+
+def _cached(cache, fname, load):
+    """
+    Return load(fname), reusing the result stored in the dictionary cache as 
+    long as size and modification time of the file do not change. Only the 
+    CACHE_SIZE most recently used files are kept.
+    """
+    stat = os.stat(fname)
+    key = os.path.abspath(fname)
+    if key in cache:
+        size, mtime, result = cache.pop(key)
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            cache[key] = size, mtime, result
+            return result
+    result = load(fname)
+    cache[key] = stat.st_size, stat.st_mtime_ns, result
+    while len(cache) > CACHE_SIZE:
+        del cache[next(iter(cache))]
+    return result
+
+
+def _parse_his_lines(lines, partial=False):
+    """
+    Parse the records of a his file contained in lines.
+    
+    partial: if True, an incomplete last record is not parsed
+    
+    Returns the list of records and the number of lines consumed.
+    """
+    records = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip() or line[0] in '#*':
+            i += 1
+            continue
+        ncolumns, npoints = [int(var) for var in line.split()]
+        if partial and i + 2 + npoints > len(lines):
+            break
+        i += 2      # header and line with column titles
+        if npoints > 0:
+            data = np.loadtxt(lines[i:i+npoints], ndmin=2)
+        else:
+            data = np.zeros((0, ncolumns+1))
+        if len(data) < npoints:
+            raise ValueError('Incomplete record %d' % (len(records)+1))
+        records.append(data)
+        i += npoints
+    return records, i
+
+
+def _load_his(fname):
+    """
+    Parse all records of a his file.
+    """
+    with open_output(fname) as f:
+        lines = f.readlines()
+    try:
+        records, __ = _parse_his_lines(lines)
+    except ValueError as err:
+        raise ValueError(str(err) + ' in ' + fname)
+    return records
+
+
+_his_records = {}
+
+
+def read_his_all(fname):
+    """
+    Read all records of a his file in one pass.
     
+    Returns a list with one 2D array per record. Column 0 contains the 
+    abscissas, column i the histogram of atom species i (i=1...ion, i=2...first 
+    target atom etc. for atomic ions). The result is cached as long as size and 
+    modification time of the file do not change and must not be modified.
+    """
+    return _cached(_his_records, fname, _load_his)
+
 
 def read_his(fname, record=1, column=1, n_merge=1):
     """
@@ -274,95 +639,619 @@ def read_his(fname, record=1, column=1, n_merge=1):
              column=1...ion, column=2...first target atom etc. (for atomic ions)
     n_merge: Number of boxes to be merged. The box boundary closest to the 
              origin will be maintained.
+    
+    The file is parsed only once by read_his_all.
     """
     
     if not os.path.exists(fname):
         print(fname, 'does not exist.')
 
-    with open(fname) as f:
-        for i in range(record):
-            while True:
-                line = f.readline()
-                if line[0] not in '#*':
-                    break
-            ncolumns, npoints = [int(var) for var in line.split()]
-            line = f.readline()
-            x = []
-            hist = []
-            for __ in range(npoints):
-                line = f.readline()
-                if i != record-1:
-                    continue
-                items = line.split()
-                x.append(float(items[0]))
-                hist.append(float(items[column]))
-    
-    x = np.array(x)
-    hist = np.array(hist)
+    if record < 1:
+        raise IndexError('Record %d not in %s' % (record, fname))
+    data = read_his_all(fname)[record-1]
+    x = data[:,0].copy()
+    hist = data[:,column].copy()
     if n_merge > 1:
         x, hist = merge_boxes(x, hist, n_merge)
 
     return x, hist
 
 
-def read_his2(fname, rec=1, atom=1):
+def _fortran_records(fname):
+    """
+    Return the offsets and lengths (in bytes) of the data of all records of an 
+    unformatted sequential Fortran file with 4-byte record markers.
+    """
+    offsets = []
+    lengths = []
+    size = os.path.getsize(fname)
+    with open(fname, 'rb') as f:
+        pos = 0
+        while pos < size:
+            f.seek(pos)
+            head = f.read(4)
+            if len(head) < 4:
+                raise ValueError('Truncated record marker at byte %d of %s'
+                                 % (pos, fname))
+            n, = struct.unpack('<i', head)
+            f.seek(pos + 4 + n)
+            tail = f.read(4)
+            if n < 0 or len(tail) < 4 or struct.unpack('<i', tail)[0] != n:
+                raise ValueError('Ill-formatted Fortran record at byte %d of %s'
+                                 % (pos, fname))
+            offsets.append(pos + 4)
+            lengths.append(n)
+            pos += n + 8
+    return offsets, lengths
+
+
+def iter_fortran_records(f):
+    """
+    Read the records of an unformatted sequential Fortran file with 4-byte 
+    record markers from a binary stream, e.g. a decompressing file object (see 
+    open_output). Yields the data of each record as bytes.
+    """
+    pos = 0
+    while True:
+        head = f.read(4)
+        if not head:
+            break
+        if len(head) < 4:
+            raise ValueError('Truncated record marker at byte %d' % pos)
+        n, = struct.unpack('<i', head)
+        data = f.read(n) if n >= 0 else b''
+        tail = f.read(4)
+        if (n < 0 or len(data) < n or len(tail) < 4 or 
+            struct.unpack('<i', tail)[0] != n):
+            raise ValueError('Ill-formatted Fortran record at byte %d' % pos)
+        yield data
+        pos += n + 8
+
+
+class HisCatalog:
+    """
+    Catalog of the records of a 2D (.his*2) or 3D (.his*3) histogram file.
+    
+    The Fortran record markers are scanned once and the offset, shape and data 
+    type of the title, axes and per-atom histograms of each record are stored. 
+    Histograms are returned as memory maps, so only the data actually accessed 
+    are read from the file.
+    
+    Compressed files (see open_output) cannot be memory mapped. They are 
+    decompressed once and the data of the Fortran records are kept in memory; 
+    the offsets then refer to this list of records.
+    
+    Records and atoms are numbered from 1.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.records = []
+        if is_compressed(fname):
+            with open_output(fname, 'rb') as f:
+                self.blocks = list(iter_fortran_records(f))
+            offsets = list(range(len(self.blocks)))
+            lengths = [len(block) for block in self.blocks]
+        else:
+            self.blocks = None
+            offsets, lengths = _fortran_records(fname)
+        i = 0
+        with open(fname, 'rb') as f:
+            def read(i):
+                if self.blocks is not None:
+                    return self.blocks[offsets[i]]
+                f.seek(offsets[i])
+                return f.read(lengths[i])
+            while i < len(offsets):
+                text = read(i).rstrip().decode('utf-8')
+                ints = [int(n) for n in np.frombuffer(read(i+1), dtype='<i4')]
+                if len(ints) == 4:
+                    na, nx, ny, nz = ints
+                    axis_sizes = (nx, ny, nz)   # x, y, z in the file
+                    shape = (nz, ny, nx)
+                elif len(ints) == 3:
+                    nz, nx, na = ints           # new format
+                    axis_sizes = (nz, nx)       # z, x in the file
+                    shape = (nz, nx)
+                else:
+                    nz, nx = ints               # old format
+                    na = 1
+                    axis_sizes = (nz, nx)
+                    shape = (nz, nx)
+                i += 2
+                axes = offsets[i:i+len(axis_sizes)]
+                dtype = np.dtype('<f%d' % (lengths[i] // axis_sizes[0]))
+                i += len(axis_sizes)
+                atoms = offsets[i:i+na]
+                i += na
+                if len(atoms) < na:
+                    raise ValueError('Incomplete record "%s" in %s' 
+                                     % (text, fname))
+                self.records.append(dict(text=text, shape=shape, dtype=dtype, 
+                                         axis_sizes=axis_sizes, axes=axes, 
+                                         atoms=atoms))
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def _record(self, rec):
+        if not 1 <= rec <= len(self.records):
+            raise IndexError('Record %d not in %s' % (rec, self.fname))
+        return self.records[rec-1]
+    
+    def text(self, rec=1):
+        """
+        Return the title of a record.
+        """
+        return self._record(rec)['text']
+    
+    def natoms(self, rec=1):
+        """
+        Return the number of atom species of a record.
+        """
+        return len(self._record(rec)['atoms'])
+    
+    def axes(self, rec=1):
+        """
+        Return the axes of a record as (x, z) for 2D and (x, y, z) for 3D 
+        histograms.
+        """
+        record = self._record(rec)
+        if self.blocks is not None:
+            axes = [np.frombuffer(self.blocks[k], dtype=record['dtype'], 
+                                  count=n)
+                    for k, n in zip(record['axes'], record['axis_sizes'])]
+        else:
+            axes = [np.fromfile(self.fname, dtype=record['dtype'], count=n, 
+                                offset=offset)
+                    for offset, n in zip(record['axes'], record['axis_sizes'])]
+        if len(axes) == 2:
+            z, x = axes
+            return x, z
+        return tuple(axes)
+    
+    def hist(self, rec=1, atom=1, mode='r'):
+        """
+        Return the histogram of an atom species of a record as a memory map, 
+        hist(z,x) for 2D and hist(z,y,x) for 3D histograms.
+        
+        mode: mode of np.memmap; 'r' is read-only, 'c' is copy-on-write
+              (for compressed files, a read-only array or a copy)
+        """
+        record = self._record(rec)
+        if not 1 <= atom <= len(record['atoms']):
+            raise IndexError('Atom %d not in record %d of %s' 
+                             % (atom, rec, self.fname))
+        if self.blocks is not None:
+            hist = np.frombuffer(self.blocks[record['atoms'][atom-1]], 
+                                 dtype=record['dtype'])
+            hist = hist[:np.prod(record['shape'])].reshape(record['shape'])
+            return hist.copy() if mode == 'c' else hist
+        return np.memmap(self.fname, dtype=record['dtype'], mode=mode, 
+                         offset=record['atoms'][atom-1], shape=record['shape'])
+
+
+_his_catalogs = {}
+
+
+def his_catalog(fname):
+    """
+    Return the HisCatalog of a .his*2 or .his*3 file. Catalogs are cached as 
+    long as size and modification time of the file do not change.
+    """
+    return _cached(_his_catalogs, fname, HisCatalog)
+
+
+def clear_caches():
+    """
+    Clear the caches of parse_out, read_his_all and his_catalog.
+    """
+    _out_files.clear()
+    _his_records.clear()
+    _his_catalogs.clear()
+
+
+def list_records(fname):
+    """
+    Return the table of contents of a histogram file without reading the 
+    histograms, as a list with one dictionary per record containing
+    
+    text:    title of the record (for 1D histograms the last comment line 
+             before the record, '' if there is none)
+    natoms:  number of atom species
+    shape:   number of histogram values, (npoints,) for 1D, (nz, nx) for 2D 
+             and (nz, ny, nx) for 3D histograms
+    columns: column titles (1D histograms only)
+    
+    For .his*2 and .his*3 files the record markers are used to skip the data 
+    (see HisCatalog); the lines of 1D histograms are skipped without parsing.
+    """
+    if output_ext(fname) in HIS2_EXTS + HIS3_EXTS:
+        catalog = his_catalog(fname)
+        return [dict(text=record['text'], natoms=len(record['atoms']), 
+                     shape=record['shape']) 
+                for record in catalog.records]
+    
+    toc = []
+    text = ''
+    with open_output(fname) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if line[0] in '#*':
+                text = line[1:].strip()
+                continue
+            ncolumns, npoints = [int(var) for var in line.split()]
+            columns = next(f, '').split()
+            toc.append(dict(text=text, natoms=ncolumns, shape=(npoints,), 
+                            columns=columns))
+            text = ''
+            for __ in islice(f, npoints):
+                pass
+    return toc
+
+
+class SparseHist:
+    """
+    Sparse representation of a 2D histogram hist(z,x) or a 3D histogram 
+    hist(z,y,x), storing only the nonzero values of each z plane.
+    
+    shape:   shape of the dense histogram
+    indptr:  data[indptr[i]:indptr[i+1]] are the nonzero values of the plane 
+             z[i]
+    indices: flat indices of the values within their plane (see 
+             np.ravel_multi_index)
+    data:    nonzero values
+    
+    Indexing with an integer returns a dense plane, indexing with a slice or an 
+    index array along z returns a SparseHist of the selected planes. np.asarray 
+    converts to the dense histogram, so blockwise functions such as 
+    bounding_box and max_projections accept a SparseHist.
+    """
+    def __init__(self, shape, indptr, indices, data):
+        self.shape = tuple(shape)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+    
+    @classmethod
+    def from_dense(cls, hist, block_size=2**24):
+        """
+        Build the sparse representation of a dense histogram or memory map, 
+        processing blocks of about block_size bytes along z (see bounding_box).
+        """
+        nz = hist.shape[0]
+        step = max(1, block_size // max(1, hist[:1].nbytes))
+        counts = []
+        indices = []
+        data = []
+        for i in range(0, nz, step):
+            block = np.asarray(hist[i:i+step]).reshape((-1, 
+                                                       np.prod(hist.shape[1:])))
+            rows, cols = np.nonzero(block)
+            counts.append(np.bincount(rows, minlength=len(block)))
+            indices.append(cols.astype(np.int32))
+            data.append(block[rows, cols])
+        indptr = np.concatenate(((0,), np.cumsum(np.concatenate(counts))))
+        return cls(hist.shape, indptr, np.concatenate(indices), 
+                   np.concatenate(data))
+    
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    @property
+    def dtype(self):
+        return self.data.dtype
+    
+    @property
+    def nnz(self):
+        """
+        Number of nonzero values.
+        """
+        return len(self.data)
+    
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+    
+    def __len__(self):
+        return self.shape[0]
+    
+    def coords(self):
+        """
+        Return the index arrays (z, x) or (z, y, x) of the nonzero values.
+        """
+        iz = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return (iz,) + np.unravel_index(self.indices, self.shape[1:])
+    
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.shape[0]
+            plane = np.zeros(np.prod(self.shape[1:]), dtype=self.dtype)
+            start, stop = self.indptr[key], self.indptr[key+1]
+            plane[self.indices[start:stop]] = self.data[start:stop]
+            return plane.reshape(self.shape[1:])
+        
+        rows = np.arange(self.shape[0])[key]
+        starts = self.indptr[rows]
+        counts = self.indptr[rows+1] - starts
+        ends = np.cumsum(counts)
+        idx = (np.arange(ends[-1] if len(ends) else 0) + 
+               np.repeat(starts - (ends - counts), counts))
+        return SparseHist((len(rows),) + self.shape[1:], 
+                          np.concatenate(((0,), ends)), 
+                          self.indices[idx], self.data[idx])
+    
+    def toarray(self):
+        """
+        Return the dense histogram.
+        """
+        hist = np.zeros(self.shape, dtype=self.dtype)
+        hist.reshape(-1)[self.indices + 
+                         np.repeat(np.arange(self.shape[0]) * 
+                                   np.prod(self.shape[1:]), 
+                                   np.diff(self.indptr))] = self.data
+        return hist
+    
+    def __array__(self, dtype=None, copy=None):
+        hist = self.toarray()
+        return hist if dtype is None else hist.astype(dtype)
+    
+    def sum(self, axis=None):
+        """
+        Return the sum of all values (axis=None) or the dense projection 
+        obtained by summing along an axis.
+        """
+        if axis is None:
+            return self.data.sum()
+        return self._project(axis, np.add)
+    
+    def max(self, axis=None):
+        """
+        Return the maximum of all values (axis=None) or the dense maximum 
+        projection along an axis. Missing values count as zero.
+        """
+        if axis is None:
+            if self.nnz < np.prod(self.shape):
+                return self.data.max(initial=0)
+            return self.data.max()
+        return self._project(axis, np.maximum)
+    
+    def _project(self, axis, ufunc):
+        coords = list(self.coords())
+        del coords[axis]
+        shape = self.shape[:axis] + self.shape[axis+1:]
+        result = np.zeros(np.prod(shape), dtype=self.dtype)
+        ufunc.at(result, np.ravel_multi_index(coords, shape), self.data)
+        return result.reshape(shape)
+
+
+def read_his2(fname, rec=1, atom=1, sparse=False):
     """
     Read a his2 file.
     
-    The returned histogram is hist(z,x).
+    The returned histogram is hist(z,x). It is a copy-on-write memory map of 
+    the file (see HisCatalog), or a SparseHist if sparse is True.
     """
     if not os.path.exists(fname):
         print(fname, 'does not exist.')
 
-    f = FortranFile(fname)
-    for _ in range(rec):
-        chars = f.read_record(np.dtype('a1'))
-        text = chars.tobytes().rstrip()
-#        print('Reading record "', text, '"')
-        ints = f.read_ints()
-        print('ints=', ints)
-        if len(ints) == 3:
-            nz, nx, na = ints       # new format
-        else:
-            nz, nx = ints           # old format
-            na = 1
-        z = f.read_reals()
-        x = f.read_reals()
-        for __ in range(atom):
-            hist = f.read_reals().reshape((nz,nx))
-#            hist = np.maximum(hist, 0)
-        for __ in range(na-atom):
-            f.read_reals()
-#        print('Sum = ', np.sum(hist))
-    print(x.shape, z.shape, hist.shape)
-    return x, z, hist, text.decode('utf-8')
-
-
-def read_his3(fname, rec=1, atom=1):
+    catalog = his_catalog(fname)
+    x, z = catalog.axes(rec)
+    hist = catalog.hist(rec, atom, mode='c')
+    if sparse:
+        hist = SparseHist.from_dense(hist)
+    return x, z, hist, catalog.text(rec)
+
+
+def read_his3(fname, rec=1, atom=1, sparse=False):
     """
     Read a his3 file.
     
-    The returned histogram is hist(z,y,x).
+    The returned histogram is hist(z,y,x). It is a copy-on-write memory map of 
+    the file (see HisCatalog), or a SparseHist if sparse is True.
     """
     if not os.path.exists(fname):
         print(fname, 'does not exist.')
 
-    f = FortranFile(fname)
-    for _ in range(rec):
-        chars = f.read_record(np.dtype('a1'))
-        text = chars.tostring().rstrip()
-#        print('Reading record "', text, '"')
-        ints = f.read_ints()
-        print('ints=', ints)
-        na, nx, ny, nz = ints
-        x = f.read_reals()
-        y = f.read_reals()
-        z = f.read_reals()
-        for __ in range(atom):
-            hist = f.read_reals().reshape((nz,ny,nx))
-        for __ in range(na-atom):
-            f.read_reals()
-    return x, y, z, hist, text.decode('utf-8')
+    catalog = his_catalog(fname)
+    x, y, z = catalog.axes(rec)
+    hist = catalog.hist(rec, atom, mode='c')
+    if sparse:
+        hist = SparseHist.from_dense(hist)
+    return x, y, z, hist, catalog.text(rec)
+
+
+def bounding_box(hist, rel_threshold=1e-5, block_size=2**24):
+    """
+    Return the index ranges (slices) of the smallest box containing all values
+    of the histogram greater than rel_threshold times its maximum.
+
+    The histogram is processed in blocks of about block_size bytes along its
+    first axis, so for memory maps (see HisCatalog) only one block and the
+    maximum projection onto the remaining axes are held in memory.
+
+    Returns a tuple with one slice per dimension, or None if the histogram is
+    zero everywhere.
+    """
+    shape = hist.shape
+    step = max(1, block_size // max(1, hist[:1].nbytes))
+    profile = np.empty(shape[0], dtype=hist.dtype)
+    projection = None
+    for i in range(0, shape[0], step):
+        block = np.asarray(hist[i:i+step])
+        block_max = block.max(axis=0)
+        profile[i:i+len(block)] = block.reshape((len(block), -1)).max(axis=1)
+        if projection is None:
+            projection = block_max
+        else:
+            np.maximum(projection, block_max, out=projection)
+
+    hist_max = profile.max()
+    if hist_max <= 0:
+        return None
+    threshold = hist_max * rel_threshold
+
+    slices = []
+    for dim in range(len(shape)):
+        if dim == 0:
+            mask = profile > threshold
+        else:
+            other = tuple(d for d in range(len(shape)-1) if d != dim-1)
+            mask = projection.max(axis=other) > threshold
+        indices = np.nonzero(mask)[0]
+        slices.append(slice(indices[0], indices[-1]+1))
+    return tuple(slices)
+
+
+def crop_his3(fname, rec=1, atom=1, rel_threshold=1e-5, stride=1, n_merge=1,
+              block_size=2**24):
+    """
+    Read a his3 file cropped to the box containing the values greater than
+    rel_threshold times the maximum (see bounding_box).
+
+    stride:  take only every stride-th box along each dimension; the cropped
+             histogram is then a view of the memory map
+    n_merge: number of boxes to be merged along each dimension (see rebin);
+             the cropped histogram is then an array in memory
+
+    Either stride or n_merge may be an integer or a sequence of three values
+    for the z, y and x dimension. The full histogram is never loaded into
+    memory. Returns x, y, z, hist, text like read_his3.
+    """
+    catalog = his_catalog(fname)
+    x, y, z = catalog.axes(rec)
+    hist = catalog.hist(rec, atom, mode='c')
+
+    box = bounding_box(hist, rel_threshold, block_size)
+    if box is not None:
+        hist = hist[box]
+        z, y, x = z[box[0]], y[box[1]], x[box[2]]
+
+    stride = np.broadcast_to(stride, (3,))
+    if any(stride > 1):
+        sz, sy, sx = (slice(None, None, s) for s in stride)
+        hist = hist[sz, sy, sx]
+        z, y, x = z[sz], y[sy], x[sx]
+
+    if np.any(np.asarray(n_merge) > 1):
+        hist, (z, y, x) = rebin(hist, n_merge, (z, y, x))
+
+    return x, y, z, hist, catalog.text(rec)
+
+
+def max_projections(hist, block_size=2**24):
+    """
+    Return the maximum projections of a 3D histogram hist(z,y,x) onto the
+    xy, xz and yz planes as arrays (y,x), (z,x) and (z,y).
+
+    The histogram is processed in blocks of about block_size bytes along z (see
+    bounding_box), so memory maps are never loaded completely.
+    """
+    nz, ny, nx = hist.shape
+    step = max(1, block_size // max(1, hist[:1].nbytes))
+    proj_xy = None
+    proj_xz = np.empty((nz, nx), dtype=hist.dtype)
+    proj_yz = np.empty((nz, ny), dtype=hist.dtype)
+    for i in range(0, nz, step):
+        block = np.asarray(hist[i:i+step])
+        proj_xz[i:i+len(block)] = block.max(axis=1)
+        proj_yz[i:i+len(block)] = block.max(axis=2)
+        block_max = block.max(axis=0)
+        if proj_xy is None:
+            proj_xy = block_max
+        else:
+            np.maximum(proj_xy, block_max, out=proj_xy)
+    return proj_xy, proj_xz, proj_yz
+
+
+def _extent(a):
+    """
+    Return the limits of the boxes with the centers a.
+    """
+    d = a[1] - a[0] if len(a) > 1 else 1.
+    return a[0] - d/2, a[-1] + d/2
+
+
+def show_slices(x, y, z, hist, text='', projections=True, decades=5):
+    """
+    Show a 3D histogram hist(z,y,x) as returned by read_his3 or crop_his3 in
+    orthogonal xy, xz and yz slices with matplotlib. The positions of the
+    slices are selected with sliders. Only the slices shown are read from
+    the histogram, so it may be a memory map of a large file.
+
+    projections: also show the maximum projections (see max_projections)
+    decades:     number of decades below the maximum shown in the log scale
+
+    Returns the figure; call plt.show() to display it.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    from matplotlib.widgets import Slider
+
+    x, y, z = np.asarray(x), np.asarray(y), np.asarray(z)
+    if projections:
+        planes = max_projections(hist)
+        hist_max = planes[0].max()
+    else:
+        hist_max = max(np.asarray(hist[i]).max() for i in range(len(z)))
+    if hist_max <= 0:
+        hist_max = 1.
+    norm = LogNorm(vmin=hist_max/10**decades, vmax=hist_max, clip=True)
+
+    nrows = 2 if projections else 1
+    fig, axs = plt.subplots(nrows, 3, squeeze=False,
+                            figsize=(12, 4*nrows+1))
+    fig.subplots_adjust(bottom=0.1 + 0.15/nrows)
+    fig.suptitle(text)
+    xlim, ylim, zlim = _extent(x), _extent(y), _extent(z)
+    extents = ((xlim + ylim[::-1]), (xlim + zlim[::-1]), (ylim + zlim[::-1]))
+    labels = (('x [A]', 'y [A]'), ('x [A]', 'z [A]'), ('y [A]', 'z [A]'))
+
+    index = [len(z)//2, len(y)//2, len(x)//2]
+    def get_slices():
+        iz, iy, ix = index
+        return hist[iz], hist[:, iy, :], hist[:, :, ix]
+
+    images = []
+    titles = ('xy slice at z = %.4g', 'xz slice at y = %.4g',
+              'yz slice at x = %.4g')
+    for ax, data, extent, (xlabel, ylabel) in zip(axs[0], get_slices(),
+                                                   extents, labels):
+        images.append(ax.imshow(np.asarray(data), extent=extent, norm=norm,
+                                origin='upper', aspect='equal'))
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+    if projections:
+        for ax, data, extent, (xlabel, ylabel), plane in zip(
+                axs[1], planes, extents, labels, ('xy', 'xz', 'yz')):
+            ax.imshow(data, extent=extent, norm=norm, origin='upper',
+                      aspect='equal')
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel(ylabel)
+            ax.set_title('max projection onto ' + plane)
+    fig.colorbar(images[0], ax=axs.ravel().tolist())
+
+    def update(__=None):
+        for i, slider in enumerate(sliders):
+            index[i] = int(slider.val)
+        for ax, image, data, title, axis, i in zip(
+                axs[0], images, get_slices(), titles, (z, y, x), index):
+            image.set_data(np.asarray(data))
+            ax.set_title(title % axis[i])
+        fig.canvas.draw_idle()
+
+    sliders = []
+    for i, (name, axis) in enumerate(zip('zyx', (z, y, x))):
+        slider_ax = fig.add_axes((0.15, 0.02 + 0.03*i, 0.6, 0.02))
+        slider = Slider(slider_ax, name + ' index', 0, len(axis)-1,
+                        valinit=index[i], valstep=1)
+        slider.on_changed(update)
+        sliders.append(slider)
+    fig._slice_sliders = sliders    # keep the sliders alive
+    update()
+    return fig
 
 
 class CollisionPoint:
@@ -386,38 +1275,718 @@ class CollisionPoint:
             sys.exit("Ill-formatted line:\n" + '"' + line + '"')
 
 
-def read_trajectories(f_, casc=1, last_casc=None):
+# Record layout of one collision point (one line) of a .tra file
+TRA_DTYPE = np.dtype([('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
+                      ('dirx', 'f8'), ('diry', 'f8'), ('dirz', 'f8'),
+                      ('e', 'f8'),
+                      ('i1', 'i4'), ('ig', 'i4'), ('iflag', 'i4')])
+
+# iflag values terminating a trajectory
+TRA_END_FLAGS = (0, 3, 4, 5)
+
+
+def _parse_tra_bytes(buf):
     """
-    Read a tra file of one or several cascades and return a list of cascades 
-    consisting of lists of trajectories consisting of lists of collision points.
+    Parse complete lines of a tra file into a structured array of TRA_DTYPE.
     
-    f_:        name or file object of .tra file
-    casc:      first cascade to be read 
-               (in case f_ is a file object, relative to current position)
-    last_casc: last cascade to be read; None means last_casc=casc
-               (in case f_ is a file object, relative to current position)
+    buf: bytes containing an integer number of lines
     """
-    if isinstance(f_, str):
-        fname = f_
-        if not os.path.exists(fname):
-            print(fname, 'does not exist.')
-        f = open(fname)
-    else:
-        f = f_
+    if not buf.strip():
+        return np.zeros(0, dtype=TRA_DTYPE)
+    return np.loadtxt(io.BytesIO(buf), dtype=TRA_DTYPE, ndmin=1)
+
+
+def _iter_tra_chunks(f, block_size=2**24):
+    """
+    Read a binary file object in blocks of about block_size bytes, each ending 
+    at a line end. Yields the file position of the block and the block.
+    """
+    pos = f.tell()
+    rest = b''
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            rest = data
+            continue
+        yield pos, data[:end]
+        pos += end
+        rest = data[end:]
+    if rest.strip():
+        yield pos, rest
+
+
+def _line_starts(buf):
+    """
+    Return the offsets of the non-blank lines in buf.
+    """
+    chars = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(chars == ord('\n'))
+    if len(buf) and buf[-1:] != b'\n':
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate(([0], ends[:-1]+1)).astype(np.int64)
+    lengths = ends - starts
+    blank = (lengths == 0) | ((lengths == 1) & 
+                              (chars[np.minimum(starts, len(buf)-1)] == 13))
+    return starts[~blank]
+
+
+def _cascade_starts(points):
+    """
+    Return a boolean array marking the first point of each cascade.
+    """
+    return (points['i1'] == 1) & (points['ig'] == 1) & (points['iflag'] == 1)
+
+
+def _trajectory_offsets(points, casc_offsets):
+    """
+    Group the points of complete cascades into trajectories.
+    
+    This is the array version of the trajectory stack in read_trajectories: 
+    A point of generation ig belongs to the current trajectory of its 
+    generation, which is terminated by an end flag or when it turns virtual. 
+    A trajectory is identified by its cascade, its generation, and the number 
+    of trajectories of the same generation terminated before. Trajectories that 
+    are not terminated within their cascade are dropped.
+    
+    Returns traj_points (point indices ordered by trajectory), traj_offsets 
+    (trajectory boundaries in traj_points) and casc_traj_offsets (cascade 
+    boundaries in the list of trajectories).
+    """
+    npoints = len(points)
+    ncasc = len(casc_offsets) - 1
+    cid = np.repeat(np.arange(ncasc), np.diff(casc_offsets))
+    i1 = points['i1']
+    ig = points['ig']
+    iflag = points['iflag']
+    closes = np.isin(iflag, TRA_END_FLAGS)
+    virtual_end = (i1 < 0) & np.isin(iflag, (3, 4, 5))
+    
+    # point indices grouped by generation, in file order within a generation
+    order = np.argsort(ig, kind='stable')
+    generations, gen_starts = np.unique(ig[order], return_index=True)
+    gen_ends = np.append(gen_starts[1:], npoints)
+    members = {g: order[start:end] 
+               for g, start, end in zip(generations, gen_starts, gen_ends)}
+    
+    # times at which the current trajectory of each generation is terminated; 
+    # a trajectory turning virtual is terminated after the point that triggers 
+    # it, which is expressed by the second sort key
+    event_times = {g: [idx[closes[idx]]] for g, idx in members.items()}
+    event_kinds = {g: [np.zeros(len(event_times[g][0]), dtype=int)] 
+                   for g in members}
+    for g, idx in members.items():
+        if g-1 not in members:
+            continue
+        cand = idx[virtual_end[idx]]
+        parent = members[g-1]
+        pos = np.searchsorted(parent, cand) - 1
+        valid = pos >= 0
+        cand = cand[valid]
+        q = parent[pos[valid]]
+        valid = (cid[q] == cid[cand]) & ~closes[q] & (i1[q] == -i1[cand])
+        # only the first trigger terminates the trajectory
+        __, first = np.unique(q[valid], return_index=True)
+        trigger = np.sort(cand[valid][first])
+        event_times[g-1].append(trigger)
+        event_kinds[g-1].append(np.ones(len(trigger), dtype=int))
+    
+    # assign points to terminated trajectories
+    traj_id = np.full(npoints, -1)
+    all_times = []
+    all_kinds = []
+    ntraj = 0
+    for g, idx in members.items():
+        times = np.concatenate(event_times[g])
+        kinds = np.concatenate(event_kinds[g])
+        sorter = np.argsort(times, kind='stable')
+        times = times[sorter]
+        kinds = kinds[sorter]
+        k = np.searchsorted(times, idx, side='left')
+        terminated = k < len(times)
+        terminated[terminated] = cid[times[k[terminated]]] == cid[idx[terminated]]
+        traj_id[idx[terminated]] = ntraj + k[terminated]
+        all_times.append(times)
+        all_kinds.append(kinds)
+        ntraj += len(times)
+    all_times = np.concatenate(all_times) if all_times else np.zeros(0, int)
+    all_kinds = np.concatenate(all_kinds) if all_kinds else np.zeros(0, int)
+    
+    # order trajectories by the time of termination
+    traj_order = np.lexsort((all_kinds, all_times))
+    rank = np.empty(ntraj, dtype=int)
+    rank[traj_order] = np.arange(ntraj)
+    kept = np.flatnonzero(traj_id >= 0)
+    point_rank = rank[traj_id[kept]]
+    traj_points = kept[np.argsort(point_rank, kind='stable')]
+    traj_offsets = np.concatenate(((0,), np.cumsum(np.bincount(point_rank, 
+                                                    minlength=ntraj))))
+    traj_cid = cid[all_times[traj_order]]
+    casc_traj_offsets = np.searchsorted(traj_cid, np.arange(ncasc+1))
+    
+    return traj_points, traj_offsets, casc_traj_offsets
+
+
+class TrajectoryArrays:
+    """
+    Columnar representation of one or several cascades of a tra file.
+    
+    points:            structured array (TRA_DTYPE) of all collision points in 
+                       file order
+    casc_offsets:      points[casc_offsets[i]:casc_offsets[i+1]] are the 
+                       points of the i-th cascade
+    traj_points:       indices of points, ordered by trajectory
+    traj_offsets:      traj_points[traj_offsets[j]:traj_offsets[j+1]] are the 
+                       points of the j-th trajectory
+    casc_traj_offsets: trajectories casc_traj_offsets[i] to 
+                       casc_traj_offsets[i+1]-1 belong to the i-th cascade
+    """
+    def __init__(self, points, casc_offsets=None):
+        self.points = points
+        if casc_offsets is None:
+            starts = _cascade_starts(points)
+            starts[:1] = True
+            casc_offsets = np.append(np.flatnonzero(starts), len(points))
+        self.casc_offsets = casc_offsets
+        self.traj_points, self.traj_offsets, self.casc_traj_offsets = \
+            _trajectory_offsets(points, casc_offsets)
+        
+    def __len__(self):
+        return len(self.casc_offsets) - 1
+    
+    def cascade_points(self, i):
+        """
+        Return the collision points of the i-th cascade in file order.
+        """
+        return self.points[self.casc_offsets[i]:self.casc_offsets[i+1]]
+    
+    def trajectory(self, j):
+        """
+        Return the collision points of the j-th trajectory.
+        """
+        return self.points[self.traj_points[self.traj_offsets[j]:
+                                            self.traj_offsets[j+1]]]
+    
+    def trajectories(self, i):
+        """
+        Return the list of trajectories of the i-th cascade.
+        """
+        return [self.trajectory(j) for j in 
+                range(self.casc_traj_offsets[i], self.casc_traj_offsets[i+1])]
+    
+    def to_lists(self):
+        """
+        Return the cascades in the format of read_trajectories. The collision 
+        points are records with the same attributes as CollisionPoint.
+        """
+        points = self.points.view(np.recarray)[self.traj_points]
+        offsets = self.traj_offsets.tolist()
+        cascades = []
+        for i in range(len(self)):
+            cascade = [points[offsets[j]:offsets[j+1]] for j in 
+                       range(self.casc_traj_offsets[i], 
+                             self.casc_traj_offsets[i+1])]
+            cascades.append(cascade)
+        return cascades
+
+
+# colors of the trajectory kinds ion, virtual ion, recoil and virtual recoil 
+# and of their escape lines, in the order of drawing
+TRA_COLORS = (('y', 'g'), ('r', 'g'), ('gray', 'b'), ('k', 'b'))
+
+
+def _trajectory_kind(i1):
+    """
+    Return the index into TRA_COLORS of trajectories with first points i1.
+    """
+    return np.where(i1 == 1, 3, np.where(i1 == -1, 2, np.where(i1 > 1, 1, 0)))
+
+
+def simplify_polylines(x, z, offsets, tolerance):
+    """
+    Simplify polylines with the Douglas-Peucker algorithm and return a boolean 
+    array marking the points to be kept.
+    
+    x, z:      coordinates of the points of all polylines
+    offsets:   x[offsets[j]:offsets[j+1]] are the points of the j-th polyline
+    tolerance: maximum distance of a removed point from the simplified line
+    
+    The algorithm proceeds for all polylines at once: in each step, the point 
+    farthest from the chord of each interval between kept points is kept and 
+    splits the interval if its distance exceeds the tolerance.
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    lo = offsets[:-1][nonempty]
+    hi = offsets[1:][nonempty] - 1
+    keep[lo] = True
+    keep[hi] = True
+    while True:
+        inner = hi - lo - 1
+        open_ = inner > 0
+        lo, hi, inner = lo[open_], hi[open_], inner[open_]
+        if len(lo) == 0:
+            break
+        
+        # distances of the interior points from the chords of their intervals
+        ends = np.cumsum(inner)
+        interval = np.repeat(np.arange(len(lo)), inner)
+        idx = np.arange(ends[-1]) + np.repeat(lo + 1 - (ends - inner), inner)
+        ax, az = x[lo][interval], z[lo][interval]
+        dx, dz = x[hi][interval] - ax, z[hi][interval] - az
+        px, pz = x[idx] - ax, z[idx] - az
+        length = np.hypot(dx, dz)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.where(length > 0, np.abs(dx*pz - dz*px) / length, 
+                            np.hypot(px, pz))
         
+        # split the intervals at their farthest points
+        dmax = np.maximum.reduceat(dist, ends - inner)
+        candidates = np.flatnonzero(dist == dmax[interval])
+        __, first = np.unique(interval[candidates], return_index=True)
+        pivot = idx[candidates[first]]
+        split = dmax > tolerance
+        pivot = pivot[split]
+        keep[pivot] = True
+        lo, hi = (np.concatenate((lo[split], pivot)), 
+                  np.concatenate((pivot, hi[split])))
+    return keep
+
+
+def overview_tolerance(ax, x, z, pixels=0.5):
+    """
+    Return the simplification tolerance corresponding to pixels pixels of the 
+    axes ax, using the current view limits or, if the axes are autoscaled, the 
+    extent of the coordinates x, z.
+    """
+    bbox = ax.get_window_extent()
+    if ax.get_autoscale_on() and len(x):
+        width = max(np.ptp(x), np.ptp(z) * bbox.width / max(bbox.height, 1))
+    else:
+        width = max(abs(np.diff(ax.get_xlim()))[0], 
+                    abs(np.diff(ax.get_ylim()))[0] * bbox.width 
+                    / max(bbox.height, 1))
+    return pixels * width / max(bbox.width, 1)
+
+
+def trajectory_segments(arrays, casc=None, decimate=1, tolerance=None):
+    """
+    Return all line segments of the trajectories of a TrajectoryArrays object 
+    as an array (nseg, 2, 2) of (x, z) pairs and the indices into 
+    arrays.points of the end points of the segments.
+    
+    casc:      index (from 0) or range of cascades; None means all cascades
+    decimate:  keep only every decimate-th point of each trajectory (the last 
+               point is always kept), for overview plots of many cascades
+    tolerance: if not None, simplify the trajectories in the x-z plane such 
+               that removed points are at most tolerance away from the lines 
+               (see simplify_polylines)
+    """
+    if casc is None:
+        casc = range(len(arrays))
+    elif isinstance(casc, int):
+        casc = range(casc, casc+1)
+    first = arrays.traj_offsets[arrays.casc_traj_offsets[casc.start]]
+    last = arrays.traj_offsets[arrays.casc_traj_offsets[casc.stop]]
+    offsets = arrays.traj_offsets
+    
+    # position of each point within its trajectory
+    lengths = np.diff(offsets)
+    pos = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    keep = (pos % decimate == 0) | (pos == np.repeat(lengths, lengths) - 1)
+    keep[:first] = False
+    keep[last:] = False
+    if tolerance is not None and last > first:
+        ipoints = arrays.traj_points[first:last]
+        traj_offsets = offsets[arrays.casc_traj_offsets[casc.start]:
+                               arrays.casc_traj_offsets[casc.stop]+1]
+        keep[first:last] &= simplify_polylines(
+            arrays.points['x'][ipoints], arrays.points['z'][ipoints], 
+            traj_offsets - first, tolerance)
+    kept = np.flatnonzero(keep)
+    
+    # connect consecutive kept points of the same trajectory
+    connected = pos[kept[1:]] != 0
+    start = arrays.traj_points[kept[:-1][connected]]
+    end = arrays.traj_points[kept[1:][connected]]
+    points = arrays.points
+    segments = np.empty((len(start), 2, 2))
+    segments[:, 0, 0] = points['x'][start]
+    segments[:, 0, 1] = points['z'][start]
+    segments[:, 1, 0] = points['x'][end]
+    segments[:, 1, 1] = points['z'][end]
+    return segments, end
+
+
+def plot_cascades(arrays, casc=None, ax=None, color='kind', decimate=1, 
+                  cmap=None, escape=True, tolerance=None):
+    """
+    Plot the trajectories of the cascades of a TrajectoryArrays object as one 
+    LineCollection in the x-z plane.
+    
+    casc:      index (from 0) or range of cascades; None means all cascades
+    ax:        matplotlib axes; None means the current axes
+    color:     'kind' colors ions, virtual ions, recoils and virtual recoils as 
+               in TRA_COLORS, 'generation' and 'energy' color the segments by 
+               the generation ig and the energy e of their end points
+    decimate:  see trajectory_segments
+    cmap:      colormap for color='generation' or 'energy'
+    escape:    draw lines in the direction of escaping particles (iflag 4, 5)
+    tolerance: see trajectory_segments; 'auto' means half a pixel at the 
+               current scale of the axes (see overview_tolerance)
+    
+    Returns the LineCollection.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import LogNorm
+    
+    if ax is None:
+        ax = plt.gca()
+    if tolerance == 'auto':
+        tolerance = overview_tolerance(ax, arrays.points['x'], 
+                                       arrays.points['z'])
+    segments, end = trajectory_segments(arrays, casc, decimate, tolerance)
+    points = arrays.points
+    
+    # kind of the trajectory of each point (see TRA_COLORS)
+    traj_first = arrays.traj_points[arrays.traj_offsets[:-1]]
+    point_kind = np.zeros(len(points), dtype=int)
+    point_kind[arrays.traj_points] = np.repeat(
+        _trajectory_kind(points['i1'][traj_first]), 
+        np.diff(arrays.traj_offsets))
+    
+    if color == 'kind':
+        kind = point_kind[end]
+        order = np.argsort(kind, kind='stable')
+        colors = [TRA_COLORS[k][0] for k in kind[order]]
+        lines = LineCollection(segments[order], colors=colors)
+    elif color in ('generation', 'energy'):
+        if color == 'generation':
+            values, norm = points['ig'][end], None
+        else:
+            values = points['e'][end]
+            positive = values[values > 0]
+            norm = LogNorm(positive.min(), positive.max()) if len(positive) \
+                   else None
+        lines = LineCollection(segments, array=values, cmap=cmap, norm=norm)
+        ax.figure.colorbar(lines, ax=ax, label=color)
+    else:
+        raise ValueError('Unknown color mode: ' + str(color))
+    ax.add_collection(lines)
+    
+    if escape and len(end):
+        # the last point of a trajectory is the end point of a segment
+        esc = end[np.isin(points['iflag'][end], (4, 5))]
+        if len(esc):
+            esc_segments = np.empty((len(esc), 2, 2))
+            esc_segments[:, 0, 0] = points['x'][esc]
+            esc_segments[:, 0, 1] = points['z'][esc]
+            esc_segments[:, 1, 0] = points['x'][esc] + 10*points['dirx'][esc]
+            esc_segments[:, 1, 1] = points['z'][esc] + 10*points['dirz'][esc]
+            esc_colors = [TRA_COLORS[k][1] for k in point_kind[esc]]
+            ax.add_collection(LineCollection(esc_segments, colors=esc_colors))
+    
+    ax.autoscale_view()
+    return lines
+
+
+def iter_cascade_blocks(fname, block_size=2**24):
+    """
+    Read a tra file in blocks of complete cascades. Yields the collision points 
+    of a block (TRA_DTYPE) and the cascade offsets within the block (see 
+    TrajectoryArrays).
+    
+    fname:      name of .tra file
+    block_size: number of bytes parsed at once
+    """
+    rest = np.zeros(0, dtype=TRA_DTYPE)
+    with open_output(fname, 'rb') as f:
+        for __, buf in _iter_tra_chunks(f, block_size):
+            points = _parse_tra_bytes(buf)
+            if len(rest):
+                points = np.concatenate((rest, points))
+            if len(points) == 0:
+                continue
+            starts = _cascade_starts(points)
+            starts[0] = True
+            offsets = np.flatnonzero(starts)
+            if offsets[-1] > 0:
+                yield points[:offsets[-1]], offsets
+            rest = points[offsets[-1]:]
+    if len(rest):
+        yield rest, np.array([0, len(rest)])
+
+
+def build_tra_index(fname, block_size=2**24):
+    """
+    Scan a tra file and return the byte offsets of all cascade starts. The 
+    file size is appended as the last element, so cascade i (i=1...) occupies 
+    the bytes offsets[i-1] to offsets[i]-1.
+    
+    fname:      name of .tra file
+    block_size: number of bytes parsed at once
+    """
+    offsets = []
+    with open_output(fname, 'rb') as f:
+        for pos, buf in _iter_tra_chunks(f, block_size):
+            if not buf.strip():
+                continue
+            flags = np.loadtxt(io.BytesIO(buf), dtype=np.int64, 
+                               usecols=(7, 8, 9), ndmin=2)
+            starts = _line_starts(buf)
+            if len(starts) != len(flags):
+                raise ValueError('Ill-formatted trajectory file.')
+            is_start = np.all(flags == 1, axis=1)
+            offsets.append(pos + starts[is_start])
+        size = f.tell()
+    offsets = np.concatenate(offsets) if offsets else np.zeros(0, np.int64)
+    if size > 0 and (len(offsets) == 0 or offsets[0] != 0):
+        # the first line always starts a cascade
+        offsets = np.insert(offsets, 0, 0)
+    return np.append(offsets, size)
+
+
+def savez_atomic(fname, **arrays):
+    """
+    Store arrays in the npz file fname (see np.savez). The file is written to a 
+    temporary file in the same directory first and then renamed, so an 
+    interrupted write never leaves a damaged file behind.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)),
+                                    prefix=os.path.basename(fname) + '.', 
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_name, fname)
+    except BaseException:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def tra_index(fname, build=True):
+    """
+    Return the cascade offsets of a tra file (see build_tra_index).
+    
+    The offsets are stored in the file <fname>.idx together with the size and 
+    the modification time of the tra file and are rebuilt if these do not 
+    match.
+    
+    fname: name of .tra file
+    build: if False, return None instead of building a missing or outdated 
+           index
+    
+    Compressed files (see open_output) are not indexed, None is returned.
+    """
+    if is_compressed(fname):
+        return None
+    stat = os.stat(fname)
+    index_name = fname + '.idx'
+    try:
+        with np.load(index_name) as index:
+            if (index['size'] == stat.st_size and 
+                index['mtime'] == stat.st_mtime_ns):
+                return index['offsets']
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        pass    # missing or damaged index, treated as outdated
+    
+    if not build:
+        return None
+    offsets = build_tra_index(fname)
+    try:
+        savez_atomic(index_name, size=stat.st_size, mtime=stat.st_mtime_ns, 
+                     offsets=offsets)
+    except OSError:
+        print('Could not write', index_name)
+    return offsets
+
+
+def _read_tra_range(fname, start, stop):
+    """
+    Parse the bytes start to stop-1 of a tra file.
+    """
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        buf = f.read(stop - start)
+    return _parse_tra_bytes(buf)
+
+
+def _parse_tra_span(args):
+    """
+    Parse the cascades of a tra file starting in the bytes start to stop-1. 
+    If aligned is True, start and stop are known to be cascade starts (or the 
+    file end).
+    """
+    fname, start, stop, aligned, block_size = args
+    if aligned:
+        return _read_tra_range(fname, start, stop)
+    
+    pieces = []
+    with open(fname, 'rb') as f:
+        if start > 0:
+            # go to the first line starting at or after start
+            f.seek(start - 1)
+            f.readline()
+        found = start == 0      # first cascade of the span found
+        for pos, buf in _iter_tra_chunks(f, block_size):
+            points = _parse_tra_bytes(buf)
+            lines = pos + _line_starts(buf)
+            if len(lines) != len(points):
+                raise ValueError('Ill-formatted trajectory file.')
+            starts = np.flatnonzero(_cascade_starts(points))
+            lo = 0
+            if not found:
+                if len(starts) == 0:
+                    continue
+                lo = starts[0]
+                found = True
+            beyond = starts[(starts >= lo) & (lines[starts] >= stop)]
+            if len(beyond):
+                pieces.append(points[lo:beyond[0]])
+                break
+            pieces.append(points[lo:])
+    
+    if pieces:
+        return np.concatenate(pieces)
+    return np.zeros(0, dtype=TRA_DTYPE)
+
+
+def _read_tra_parallel(fname, bounds, workers, block_size):
+    """
+    Parse a tra file in a process pool and return the collision points.
+    
+    bounds: offsets of cascade starts (see tra_index) from which the spans of 
+            the workers are chosen; None means that the whole file is split 
+            into spans of equal size, which are aligned to cascade starts by 
+            the workers
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    nworkers = workers or os.cpu_count()
+    if bounds is None:
+        bounds = np.linspace(0, os.path.getsize(fname), nworkers+1)
+        bounds = np.unique(bounds.astype(np.int64))
+        aligned = False
+    else:
+        ibounds = np.linspace(0, len(bounds)-1, nworkers+1).round()
+        bounds = np.unique(bounds[ibounds.astype(int)])
+        aligned = True
+    spans = [(fname, start, stop, aligned, block_size) 
+             for start, stop in zip(bounds[:-1], bounds[1:])]
+    
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        pieces = list(executor.map(_parse_tra_span, spans))
+    if pieces:
+        return np.concatenate(pieces)
+    return np.zeros(0, dtype=TRA_DTYPE)
+
+
+def read_trajectory_arrays(fname, casc=1, last_casc=None, block_size=2**24,
+                           index=None, workers=1):
+    """
+    Read one or several cascades of a tra file into a TrajectoryArrays object.
+    The file is parsed in blocks of lines without creating an object per 
+    collision point.
+    
+    fname:      name of .tra file
+    casc:       first cascade to be read
+    last_casc:  last cascade to be read; None means last_casc=casc, -1 means 
+                up to the end of the file
+    block_size: number of bytes parsed at once
+    index:      cascade offsets as returned by tra_index; if None, an up to 
+                date index file is used if present; False means no index. 
+                With an index, only the requested cascades are read.
+    workers:    number of processes parsing parts of the file aligned to 
+                cascade starts in parallel; None means the number of CPUs. 
+                Without an index, the whole file is parsed if workers != 1.
+    """
+    if not os.path.exists(fname):
+        print(fname, 'does not exist.')
     if last_casc is None:
         last_casc = casc
+    if last_casc == -1:
+        last_casc = np.iinfo(np.int64).max
     assert last_casc >= casc
-
-    cascades = []
     
+    if index is None:
+        index = tra_index(fname, build=False)
+    elif index is False:
+        index = None
+    if is_compressed(fname):
+        # compressed files can only be read sequentially
+        index = None
+        workers = 1
+    if index is not None:
+        ncasc = len(index) - 1
+        if last_casc >= ncasc:
+            print('End of file reached')
+        if casc > ncasc:
+            return TrajectoryArrays(np.zeros(0, dtype=TRA_DTYPE))
+        last_casc = min(last_casc, ncasc)
+        if workers == 1:
+            points = _read_tra_range(fname, index[casc-1], index[last_casc])
+        else:
+            points = _read_tra_parallel(fname, index[casc-1:last_casc+1], 
+                                        workers, block_size)
+        return TrajectoryArrays(points)
+    
+    if workers != 1:
+        points = _read_tra_parallel(fname, None, workers, block_size)
+        starts = _cascade_starts(points)
+        starts[:1] = True
+        offsets = np.append(np.flatnonzero(starts), len(points))
+        ncasc = len(offsets) - 1
+        if last_casc >= ncasc:
+            print('End of file reached')
+        if casc > ncasc:
+            return TrajectoryArrays(np.zeros(0, dtype=TRA_DTYPE))
+        last_casc = min(last_casc, ncasc)
+        return TrajectoryArrays(points[offsets[casc-1]:offsets[last_casc]])
+    
+    pieces = []
+    ncasc = 0       # number of cascades started before the current block
+    with open_output(fname, 'rb') as f:
+        for __, buf in _iter_tra_chunks(f, block_size):
+            points = _parse_tra_bytes(buf)
+            starts = _cascade_starts(points)
+            if ncasc == 0:
+                starts[:1] = True
+            cnum = ncasc + np.cumsum(starts)
+            lo = np.searchsorted(cnum, casc, side='left')
+            hi = np.searchsorted(cnum, last_casc, side='right')
+            if hi > lo:
+                pieces.append(points[lo:hi])
+            if len(cnum):
+                ncasc = cnum[-1]
+            if ncasc > last_casc:
+                break
+        else:
+            print('End of file reached')
+    
+    if pieces:
+        points = np.concatenate(pieces)
+    else:
+        points = np.zeros(0, dtype=TRA_DTYPE)
+    return TrajectoryArrays(points)
+
+
+def _iter_cascades(f, casc, last_casc):
+    """
+    Generate cascades from the file object f (see iter_cascades).
+    """
     # read first point
     line = f.readline()
     if not line:
         print('End of file reached')
-        if isinstance(f_, str):
-            f.close()
-        return cascades
+        return
     point = CollisionPoint(line)
     
     # skip forward to beginning of cascade casc
@@ -426,15 +1995,14 @@ def read_trajectories(f_, casc=1, last_casc=None):
             line = f.readline()
             if not line:
                 print('End of file reached')
-                if isinstance(f_, str):
-                    f.close()
-                return cascades
+                return
             point = CollisionPoint(line)
             if point.i1==1 and point.ig==1 and point.iflag==1:
                 break
 
     # read cascades
-    for _ in range(casc, last_casc+1):
+    icasc = casc
+    while last_casc is None or icasc <= last_casc:
         cascade = []                    # list of all trajectories
         trajectory_stack = [ [point] ]  # stack of current generation trajectories
         # loop over collision points of one cascade
@@ -444,10 +2012,8 @@ def read_trajectories(f_, casc=1, last_casc=None):
             line = f.readline()
             if not line:
                 print('End of file reached')
-                cascades.append(cascade)
-                if isinstance(f_, str):
-                    f.close()
-                return cascades
+                yield cascade
+                return
             point = CollisionPoint(line)
             if point.i1==1 and point.ig==1 and point.iflag==1:
                 # next cascade reached
@@ -485,22 +2051,363 @@ def read_trajectories(f_, casc=1, last_casc=None):
                 else:
                     break
 
-        cascades.append(cascade)
+        icasc += 1
+        if last_casc is not None and icasc > last_casc:
+            # leave the file at the beginning of the next cascade
+            f.seek(old_pos)
+        yield cascade
 
+
+def iter_cascades(f_, casc=1, last_casc=None):
+    """
+    Generate the cascades of a tra file one at a time. Each cascade is a list 
+    of trajectories consisting of lists of collision points as returned by 
+    read_trajectories, but only the current cascade is kept in memory.
+    
+    f_:        name or file object of .tra file
+    casc:      first cascade to be read 
+               (in case f_ is a file object, relative to current position)
+    last_casc: last cascade to be read; None means up to the end of the file
+               (in case f_ is a file object, relative to current position)
+    
+    In case f_ is a file object and last_casc is reached, the file is left at 
+    the beginning of the next cascade.
+    """
+    if last_casc is not None:
+        assert last_casc >= casc
     if isinstance(f_, str):
-        f.close()
+        fname = f_
+        if not os.path.exists(fname):
+            print(fname, 'does not exist.')
+        with open_output(fname) as f:
+            yield from _iter_cascades(f, casc, last_casc)
     else:
-        f.seek(old_pos)
+        yield from _iter_cascades(f_, casc, last_casc)
+
+
+def sample_cascades(fname, n, seed=None, index=None, block_size=2**24):
+    """
+    Read a uniform random sample of n cascades of a tra file (all cascades if 
+    there are fewer).
+    
+    fname:      name of .tra file
+    n:          number of cascades
+    seed:       seed of the random number generator (see 
+                np.random.default_rng)
+    index:      cascade offsets as returned by tra_index; if None, an up to 
+                date index file is used if present; False means no index. 
+                With an index, only the selected cascades are read, otherwise 
+                the file is read once with reservoir sampling.
+    block_size: number of bytes parsed at once
+    
+    Returns the numbers of the selected cascades (from 1, in ascending order) 
+    and a TrajectoryArrays object of these cascades.
+    """
+    rng = np.random.default_rng(seed)
+    if index is None:
+        index = tra_index(fname, build=False)
+    elif index is False or is_compressed(fname):
+        index = None
+    
+    if index is not None:
+        ncasc = len(index) - 1
+        selected = np.sort(rng.choice(ncasc, min(n, ncasc), replace=False))
+        pieces = [_read_tra_range(fname, index[i], index[i+1]) 
+                  for i in selected]
+    else:
+        # reservoir sampling: cascade k (from 0) replaces a random entry of 
+        # the reservoir with probability n/(k+1)
+        reservoir = [None] * n
+        numbers = np.zeros(n, dtype=np.int64)
+        ncasc = 0
+        for points, offsets in iter_cascade_blocks(fname, block_size):
+            k = ncasc + np.arange(len(offsets)-1)
+            slots = np.where(k < n, k, rng.integers(0, k+1))
+            for i in np.flatnonzero(slots < n):
+                reservoir[slots[i]] = points[offsets[i]:offsets[i+1]].copy()
+                numbers[slots[i]] = k[i]
+            ncasc += len(offsets) - 1
+        m = min(n, ncasc)
+        order = np.argsort(numbers[:m])
+        selected = numbers[:m][order]
+        pieces = [reservoir[i] for i in order]
+    
+    if pieces:
+        points = np.concatenate(pieces)
+        casc_offsets = np.concatenate(((0,), np.cumsum([len(piece) for piece 
+                                                       in pieces])))
+    else:
+        points = np.zeros(0, dtype=TRA_DTYPE)
+        casc_offsets = np.zeros(1, dtype=np.int64)
+    return selected + 1, TrajectoryArrays(points, casc_offsets)
+
+
+def read_trajectories(f_, casc=1, last_casc=None, index=None):
+    """
+    Read a tra file of one or several cascades and return a list of cascades 
+    consisting of lists of trajectories consisting of lists of collision points.
+    
+    f_:        name or file object of .tra file
+    casc:      first cascade to be read 
+               (in case f_ is a file object, relative to current position)
+    last_casc: last cascade to be read; None means last_casc=casc, -1 means 
+               up to the end of the file
+               (in case f_ is a file object, relative to current position)
+    index:     cascade offsets as returned by tra_index, or False for no index
+               (only if f_ is a name)
+    
+    If f_ is a file name, the file is read with read_trajectory_arrays and the 
+    collision points are records of the columnar data. Otherwise, the cascades 
+    are read with iter_cascades.
+    """
+    if isinstance(f_, str):
+        return read_trajectory_arrays(f_, casc, last_casc, 
+                                      index=index).to_lists()
         
-    return cascades
+    if last_casc is None:
+        last_casc = casc
+    if last_casc == -1:
+        last_casc = None    # up to the end of the file (see iter_cascades)
+    else:
+        assert last_casc >= casc
+
+    return list(iter_cascades(f_, casc, last_casc))
+    
+    
+# Data types of the columns of binary trajectory (.trb) files
+TRB_COLUMNS = {'x': '<f4', 'y': '<f4', 'z': '<f4', 
+               'dirx': '<f4', 'diry': '<f4', 'dirz': '<f4', 'e': '<f4',
+               'i1': '<i2', 'ig': '<i2', 'iflag': '<i1'}
+TRB_MAGIC = b'IMSILTRB'
+
+
+def convert_tra(fname, bname=None, compress=False, block_size=2**24):
+    """
+    Convert a tra file into a binary trajectory file and return its name.
+    
+    The binary file contains the columns of the collision points with the data 
+    types TRB_COLUMNS and the cascade offsets (see TrajectoryArrays), followed 
+    by a JSON footer describing the columns, the footer length and TRB_MAGIC.
+    
+    fname:      name of .tra file
+    bname:      name of the binary file; None means fname with extension .trb
+    compress:   if True, the columns are compressed with zlib (the binary file 
+                can then not be memory mapped)
+    block_size: number of bytes parsed at once
+    
+    The binary file is assembled in a temporary file in the same directory and 
+    then renamed, so an interrupted conversion never leaves a truncated file 
+    behind.
+    """
+    if bname is None:
+        root = fname
+        if is_compressed(root):
+            root = os.path.splitext(root)[0]
+        bname = os.path.splitext(root)[0] + '.trb'
+    stat = os.stat(fname)
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(bname)))
+    try:
+        # write the columns to temporary files
+        tmp_names = {name: os.path.join(tmpdir, name) 
+                     for name in list(TRB_COLUMNS) + ['casc_offsets']}
+        tmp_files = {name: open(tmp_names[name], 'wb') for name in TRB_COLUMNS}
+        starts = []
+        npoints = 0
+        for points, offsets in iter_cascade_blocks(fname, block_size):
+            for name, dtype in TRB_COLUMNS.items():
+                points[name].astype(dtype).tofile(tmp_files[name])
+            starts.append(npoints + offsets[:-1])
+            npoints += len(points)
+        for f in tmp_files.values():
+            f.close()
+        starts.append([npoints])
+        casc_offsets = np.concatenate(starts).astype('<i8')
+        casc_offsets.tofile(tmp_names['casc_offsets'])
+        
+        # assemble the binary file
+        columns = {}
+        tmp_bname = os.path.join(tmpdir, 'trb')
+        with open(tmp_bname, 'wb') as f:
+            f.write(TRB_MAGIC)
+            for name, tmp_name in tmp_names.items():
+                f.write(b'\0' * (-f.tell() % 64))
+                offset = f.tell()
+                with open(tmp_name, 'rb') as g:
+                    if compress:
+                        compressor = zlib.compressobj()
+                        for data in iter(lambda: g.read(block_size), b''):
+                            f.write(compressor.compress(data))
+                        f.write(compressor.flush())
+                    else:
+                        shutil.copyfileobj(g, f, block_size)
+                dtype = TRB_COLUMNS.get(name, '<i8')
+                count = os.path.getsize(tmp_name) // np.dtype(dtype).itemsize
+                columns[name] = dtype, offset, f.tell() - offset, count
+            # the source is stored relative to the binary file
+            source = os.path.relpath(os.path.abspath(fname), 
+                                     os.path.dirname(os.path.abspath(bname)))
+            footer = json.dumps({'version': 1, 
+                                 'source': source,
+                                 'size': stat.st_size, 
+                                 'mtime': stat.st_mtime_ns,
+                                 'compression': 'zlib' if compress else None,
+                                 'columns': columns}).encode()
+            f.write(footer)
+            f.write(struct.pack('<Q', len(footer)) + TRB_MAGIC)
+        os.replace(tmp_bname, bname)
+    finally:
+        shutil.rmtree(tmpdir)
+    return bname
+
+
+class TraBinary:
+    """
+    Binary trajectory (.trb) file written by convert_tra.
+    
+    columns:      dictionary mapping the names of TRB_COLUMNS to the column 
+                  arrays, which are memory maps unless the file is compressed
+    casc_offsets: offsets of the cascades in the columns
+    header:       dictionary describing the file and its source
+    source:       name of the tra file the binary file was converted from
+    """
+    def __init__(self, bname):
+        with open(bname, 'rb') as f:
+            f.seek(-16, 2)
+            footer_len, magic = struct.unpack('<Q8s', f.read(16))
+            if magic != TRB_MAGIC:
+                raise ValueError(bname + ' is not a binary trajectory file.')
+            f.seek(-16-footer_len, 2)
+            self.header = json.loads(f.read(footer_len))
+            
+            self.columns = {}
+            for name, (dtype, offset, nbytes, count) in \
+                    self.header['columns'].items():
+                if count == 0:
+                    column = np.zeros(0, dtype=dtype)
+                elif self.header['compression']:
+                    f.seek(offset)
+                    column = np.frombuffer(zlib.decompress(f.read(nbytes)), 
+                                           dtype=dtype)
+                else:
+                    column = np.memmap(bname, dtype=dtype, mode='r', 
+                                       offset=offset, shape=(count,))
+                self.columns[name] = column
+        self.casc_offsets = self.columns.pop('casc_offsets')
+        self.source = os.path.join(os.path.dirname(os.path.abspath(bname)), 
+                                   self.header['source'])
+    
+    def is_outdated(self):
+        """
+        Return True if the tra file the binary file was converted from exists 
+        and its size or modification time have changed since the conversion.
+        """
+        try:
+            stat = os.stat(self.source)
+        except OSError:
+            return False
+        return (stat.st_size != self.header['size'] or 
+                stat.st_mtime_ns != self.header['mtime'])
+    
+    def __len__(self):
+        return len(self.casc_offsets) - 1
+    
+    def points(self, casc=1, last_casc=None):
+        """
+        Return the collision points (TRA_DTYPE) of the cascades casc to 
+        last_casc (None means last_casc=casc).
+        """
+        if last_casc is None:
+            last_casc = casc
+        start = self.casc_offsets[casc-1]
+        stop = self.casc_offsets[last_casc]
+        points = np.empty(stop - start, dtype=TRA_DTYPE)
+        for name in TRA_DTYPE.names:
+            points[name] = self.columns[name][start:stop]
+        return points
     
+    def read(self, casc=1, last_casc=None):
+        """
+        Read one or several cascades into a TrajectoryArrays object (see 
+        read_trajectory_arrays).
+        """
+        if last_casc is None:
+            last_casc = casc
+        if last_casc == -1:
+            last_casc = len(self)
+        assert last_casc >= casc
+        if last_casc >= len(self):
+            print('End of file reached')
+        if casc > len(self):
+            return TrajectoryArrays(np.zeros(0, dtype=TRA_DTYPE))
+        last_casc = min(last_casc, len(self))
+        return TrajectoryArrays(self.points(casc, last_casc))
+
+
+def tra_binary(bname, update=True):
+    """
+    Return the TraBinary of a binary trajectory file. If it is outdated (see 
+    TraBinary.is_outdated), it is converted again from its tra file like an 
+    outdated index (see tra_index).
     
+    bname:  name of .trb file
+    update: if False, only print a warning for an outdated file
+    """
+    binary = TraBinary(bname)
+    if binary.is_outdated():
+        if not update:
+            print(bname, 'is outdated')
+            return binary
+        source = binary.source
+        compress = binary.header['compression'] is not None
+        del binary      # release the memory maps before replacing the file
+        print(bname, 'is outdated, converting', source)
+        convert_tra(source, bname, compress)
+        binary = TraBinary(bname)
+    return binary
+
+
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == 'convert':
+        if (len(sys.argv) not in (3, 4) or 
+            len(sys.argv) == 4 and sys.argv[3] != '--compress'):
+            sys.exit('Usage: python ' + __file__ 
+                     + ' convert filename.tra [--compress]')
+        print('Written', convert_tra(sys.argv[2], 
+                                     compress=len(sys.argv) == 4))
+        return
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == 'list':
+        if len(sys.argv) != 3:
+            sys.exit('Usage: python ' + __file__ + ' list filename')
+        for i, record in enumerate(list_records(sys.argv[2])):
+            print('record %d: %s' % (i+1, record['text']))
+            print('    atoms: %d, shape: %s' % (record['natoms'], 
+                                                 record['shape']))
+            if 'columns' in record:
+                print('    columns:', ' '.join(record['columns']))
+        return
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == 'slices':
+        if len(sys.argv) not in (3, 4, 5):
+            sys.exit('Usage: python ' + __file__ 
+                     + ' slices filename.his3 [atom] [record]')
+        atom = int(sys.argv[3]) if len(sys.argv) >= 4 else 1
+        record = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+        x, y, z, hist, text = crop_his3(sys.argv[2], record, atom)
+        show_slices(x, y, z, hist, text)
+        plt.show()
+        return
+    
     if len(sys.argv) == 1 or len(sys.argv) > 4:
-        sys.exit('Usage: python ' + __file__ + ' filename [atom] [record]')
+        sys.exit('Usage: python ' + __file__ + ' filename [atom] [record]\n'
+                 + '       python ' + __file__ + ' list filename\n'
+                 + '       python ' + __file__ 
+                 + ' slices filename.his3 [atom] [record]\n'
+                 + '       python ' + __file__ 
+                 + ' convert filename.tra [--compress]')
         
     filename = sys.argv[1]
-    ext = os.path.splitext(filename)[1]
+    ext = output_ext(filename)
     
     if len(sys.argv) >= 3:
         column = int(sys.argv[2])
@@ -510,12 +2417,21 @@ def main():
         all_columns = True
     
     if len(sys.argv) == 4:
-        record = sys.argv[3]
+        record = int(sys.argv[3])
         all_records = False
     else:
         record = 1
         all_records = True
     
+    if ext.startswith('.his'):
+        # select records and atom species from the table of contents
+        toc = list_records(filename)
+        records = range(1, len(toc)+1) if all_records else (record,)
+        def columns(record):
+            if all_columns:
+                return range(1, toc[record-1]['natoms']+1)
+            return (column,)
+    
     if ext == '.out':
         while True:
             try:
@@ -531,37 +2447,20 @@ def main():
                 break
             column += 1
     
-    elif ext in ('.his', '.hisee', '.hisne', '.hise', 
-                 '.hisb', '.hiseb', '.hisab', '.hisaab',
-                 '.hist', '.hiset', '.hisat', '.hisaat'):
-        record_complete = True
-        while True:
-            print('record=', record, ', column=', column)
-            try:
+    elif ext in HIS_EXTS:
+        for record in records:
+            for column in columns(record):
+                print('record=', record, ', column=', column)
                 z, hist = read_his(filename, record, column)
                 plt.plot(z, hist)
                 #plt.xscale('log')
                 #plt.xscale('log')
                 plt.show()
-            except:
-                if record_complete:
-                    record_complete = False
-                    column = 0
-                    record += 1
-                else:
-                    break
-            if not all_records and record_complete:
-                break
-            if not all_columns:
-                break
-            column += 1
-                        
     
-    elif ext in ('.his2', '.hisee2', '.hisne2', '.hise2', '.his2b', '.hisa2b', '.hisa2t'):
-        record_complete = True
-        while True:
-            print('record=', record, ', column=', column)
-            try:
+    elif ext in HIS2_EXTS:
+        for record in records:
+            for column in columns(record):
+                print('record=', record, ', column=', column)
                 x, z, hist, text = read_his2(filename, record, column)
                 levels = np.array((0.001,0.003,0.01,0.03,0.1,0.3, 0.9)) \
                          * np.max(hist)
@@ -574,44 +2473,18 @@ def main():
                 plt.title('Atomic number =' + text 
                           + '\n showing 3 decades below %.4g' % np.max(hist))
                 plt.show()
-            except TypeError:
-                if record_complete:
-                    record_complete = False
-                    column = 0
-                    record += 1
-                else:
-                    break
-            if not all_records and record_complete:
-                break
-            if not all_columns:
-                break
-            column += 1
 
-    elif ext in ('.his3', '.hisee3', '.hisne3'):
+    elif ext in HIS3_EXTS:
+        # remove small values at the edges; returns hist(z,y,x)
+        x, y, z, hist, text = crop_his3(filename, record, column)
         try:
             from mayavi import mlab
         except ModuleNotFoundError:
-            print('Plotting 3D data requires mayavi2 to be installed.')
-            raise
-        x, y, z, hist, text = read_his3(filename, record, column)    # returns hist(z,y,x)
-        hist = hist.transpose((2,1,0))
-        if True:
-            # remove small values at the edges
-            hist_max_xy = np.max(np.max(hist, axis=1), axis=0)
-            hist_max_xz = np.max(np.max(hist, axis=2), axis=0)
-            hist_max_yz = np.max(np.max(hist, axis=2), axis=1)
-            hist_max = np.max(hist_max_xy)
-            ixmin = np.where(hist_max_yz > hist_max*1e-5)[0][0]
-            ixmax = np.where(hist_max_yz > hist_max*1e-5)[0][-1]
-            iymin = np.where(hist_max_xz > hist_max*1e-5)[0][0]
-            iymax = np.where(hist_max_xz > hist_max*1e-5)[0][-1]
-            izmin = np.where(hist_max_xy > hist_max*1e-5)[0][0]
-            izmax = np.where(hist_max_xy > hist_max*1e-5)[0][-1]
-            x = x[ixmin:ixmax+1]
-            y = y[iymin:iymax+1]
-            z = z[izmin:izmax+1]
-            print(ixmin,ixmax,iymin,iymax,izmin,izmax)
-            hist = hist[ixmin:ixmax+1,iymin:iymax+1,izmin:izmax+1]
+            print('mayavi2 is not installed, showing slices instead.')
+            show_slices(x, y, z, hist, text)
+            plt.show()
+            return
+        hist = np.array(hist.transpose((2,1,0)))
         hist_max = np.max(hist)
         hist = np.log10(np.maximum(hist_max/1e5, hist))
         hist_max = np.log10(hist_max)
@@ -628,46 +2501,21 @@ def main():
         mlab.title(text, size=1, height=0.9)
         mlab.show()
     
-    elif ext == '.tra':
+    elif ext in ('.tra', '.trb'):
+        if ext == '.tra':
+            index = tra_index(filename)
+        else:
+            binary = tra_binary(filename)
         casc = 1
         plt.figure()
         while True:
-            try:
-                cascade, = read_trajectories(filename, casc)
-            except ValueError:
+            if ext == '.tra':
+                arrays = read_trajectory_arrays(filename, casc, index=index)
+            else:
+                arrays = binary.read(casc)
+            if len(arrays) == 0:
                 break
-            while True:
-                try:
-                    trajectory = cascade.pop()
-                except IndexError:
-                    break
-                else:
-                    if len(trajectory) == 0:
-                        continue
-                    x = [point.x for point in trajectory]
-                    z = [point.z for point in trajectory]
-                    if trajectory[0].i1 == 1:   # ion
-                        color = 'k'
-                        extra_color = 'b'
-                        zorder = 2
-                    elif trajectory[0].i1 == -1:  # virtual ion
-                        color = 'gray'
-                        extra_color = 'b'
-                        zorder = 2
-                    elif trajectory[0].i1 > 1:  # recoil
-                        color = 'r'
-                        extra_color = 'g'
-                        zorder = 1
-                    else:                       # virtual recoil
-                        color = 'y'
-                        extra_color = 'g'
-                        zorder = -1
-                    plt.plot(x, z, color=color, zorder=zorder)
-                    last_point = trajectory[-1]
-                    if last_point.iflag in (4, 5):
-                        plt.plot((x[-1], last_point.x + 10*last_point.dirx), 
-                                 (z[-1], last_point.z + 10*last_point.dirz), 
-                                 extra_color)
+            plot_cascades(arrays, tolerance='auto')
             plt.gca().set_aspect('equal')
             plt.xlabel('lateral [A]')
             plt.ylabel('vertical [A]')
@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+"""
+Render all 1D and 2D histogram files of a project into PNG files.
+
+Usage:
+
+     python render.py <directory> [output directory] [workers]
+
+renders every record and atom species of all .his* and .his*2 files (also
+compressed, see read_output.open_output) found below <directory> into the
+output directory (default <directory>/png), mirroring the directory tree.
+
+The files are rendered with the Agg backend in a process pool. The hashes of
+the rendered histogram files are stored in the file render.json in the output
+directory, and files whose hash has not changed are not rendered again.
+"""
+import hashlib, json, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from read_output import (HIS_EXTS, HIS2_EXTS, list_records, output_ext,
+                         read_his, read_his2)
+
+
+def find_his_files(directory):
+    """
+    Return the names of all 1D and 2D histogram files below directory.
+    """
+    fnames = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if output_ext(name) in HIS_EXTS + HIS2_EXTS:
+                fnames.append(os.path.join(root, name))
+    return fnames
+
+
+def file_hash(fname, block_size=2**24):
+    """
+    Return the SHA-1 hash of the contents of a file.
+    """
+    sha1 = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for data in iter(lambda: f.read(block_size), b''):
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def render_file(fname, prefix, dpi=100):
+    """
+    Render each record and atom species of a 1D or 2D histogram file into the
+    file <prefix>_rec<record>_atom<atom>.png and return the names of the PNG
+    files.
+    
+    The figures are drawn with the Agg canvas without pyplot, so the backend 
+    of the calling process is not changed.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import numpy as np
+
+    two_d = output_ext(fname) in HIS2_EXTS
+    png_names = []
+    for record, toc in enumerate(list_records(fname), 1):
+        for atom in range(1, toc['natoms']+1):
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot()
+            if two_d:
+                x, z, hist, text = read_his2(fname, record, atom)
+                hist_max = np.max(hist)
+                if hist_max > 0:
+                    levels = np.array((0.001,0.003,0.01,0.03,0.1,0.3, 0.9)) \
+                             * hist_max
+                    ax.contour(x, -z, hist, levels)
+                ax.set_aspect('equal')
+                ax.set_xlabel('lateral [A]')
+                ax.set_ylabel('vertical [A]')
+                ax.set_title(text + '\n atom %d, showing 3 decades below %.4g'
+                             % (atom, hist_max))
+            else:
+                z, hist = read_his(fname, record, atom)
+                ax.plot(z, hist)
+                columns = toc['columns']
+                label = columns[atom] if atom < len(columns) else ''
+                ax.set_title(toc['text'] + '\n' + label)
+            png_name = '%s_rec%d_atom%d.png' % (prefix, record, atom)
+            fig.savefig(png_name, dpi=dpi)
+            png_names.append(png_name)
+    return png_names
+
+
+def _render_job(job):
+    """
+    Render a histogram file in a worker process.
+
+    job: (file name, prefix, dpi)
+    """
+    fname, prefix, dpi = job
+    try:
+        return render_file(fname, prefix, dpi)
+    except (OSError, ValueError, IndexError) as err:
+        print('Could not render', fname + ':', err)
+        return None
+
+
+def render_project(directory, out_dir=None, workers=None, dpi=100,
+                   force=False):
+    """
+    Render all histogram files below directory (see find_his_files and
+    render_file) and return a dictionary mapping the histogram file names
+    relative to directory to the lists of PNG files.
+
+    out_dir: output directory; None means <directory>/png
+    workers: number of worker processes; None means the number of CPUs
+    force:   if True, also render files whose hash has not changed
+    """
+    if out_dir is None:
+        out_dir = os.path.join(directory, 'png')
+    os.makedirs(out_dir, exist_ok=True)
+    cache_name = os.path.join(out_dir, 'render.json')
+    try:
+        with open(cache_name) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+
+    # determine the files that have changed
+    rendered = {}
+    jobs = []
+    hashes = {}
+    for fname in find_his_files(directory):
+        if os.path.abspath(fname).startswith(os.path.abspath(out_dir)+os.sep):
+            continue
+        rel = os.path.relpath(fname, directory)
+        hashes[rel] = file_hash(fname)
+        entry = cached.get(rel)
+        if (not force and entry is not None and
+            entry['hash'] == hashes[rel] and
+            all(os.path.exists(name) for name in entry['png'])):
+            rendered[rel] = entry['png']
+            continue
+        prefix = os.path.join(out_dir, rel)
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        jobs.append((rel, (fname, prefix, dpi)))
+
+    # render them
+    if workers == 1 or len(jobs) <= 1:
+        results = [_render_job(job) for __, job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_job,
+                                        [job for __, job in jobs]))
+    for (rel, __), png_names in zip(jobs, results):
+        if png_names is not None:
+            rendered[rel] = png_names
+            cached[rel] = {'hash': hashes[rel], 'png': png_names}
+
+    if jobs:
+        try:
+            with open(cache_name, 'w') as f:
+                json.dump(cached, f, indent=1)
+        except OSError:
+            print('Could not write', cache_name)
+    return rendered
+
+
+def main():
+    if len(sys.argv) not in (2, 3, 4):
+        sys.exit('Usage: python ' + __file__
+                 + ' directory [output directory] [workers]')
+
+    out_dir = sys.argv[2] if len(sys.argv) >= 3 else None
+    workers = int(sys.argv[3]) if len(sys.argv) == 4 else None
+    rendered = render_project(sys.argv[1], out_dir, workers)
+    print(sum(len(names) for names in rendered.values()), 'images of',
+          len(rendered), 'histogram files')
+
+
+if __name__ == '__main__':
+    main()
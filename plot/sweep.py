@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+"""
+Aggregate the results of a parameter sweep.
+
+Usage:
+
+    from sweep import aggregate_sweep
+    table = aggregate_sweep('sweep.par', keys=('energy',), quantities={
+        'yield': ('.out', ('Yield moments', 'Backscattered', 'mean'), 1)})
+
+The runs listed in a parameter (.par) file are processed in a process pool. The 
+extracted values are cached in the file <parameter file>.cache and are only 
+read again if the respective output file has changed. Output files archived 
+with gzip, bzip2 or xz are read directly.
+"""
+import os, pickle
+from concurrent.futures import ProcessPoolExecutor
+from read_output import (COMPRESSORS, HIS_EXTS, read_par, read_inp, read_out, 
+                         read_his)
+
+
+def _reader(ext):
+    """
+    Return the read function for files with extension ext.
+    """
+    if ext == '.out':
+        return read_out
+    elif ext == '.inp':
+        return read_inp
+    elif ext in HIS_EXTS:
+        return read_his
+    raise ValueError('No reader for file extension ' + ext)
+
+
+def _extract_run(jobs):
+    """
+    Extract the values of one run.
+    
+    jobs: list of (file name, quantity specification)
+    """
+    values = []
+    for fname, spec in jobs:
+        ext = spec[0]
+        try:
+            values.append(_reader(ext)(fname, *spec[1:]))
+        except (OSError, ValueError, IndexError) as err:
+            print('Could not read', fname + ':', err)
+            values.append(None)
+    return values
+
+
+def _load_cache(cache_name):
+    try:
+        with open(cache_name, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def _output_file(fname):
+    """
+    Return fname or, if it does not exist, the name of its compressed version 
+    (see read_output.COMPRESSORS) if that exists.
+    """
+    if not os.path.exists(fname):
+        for ext in COMPRESSORS:
+            if os.path.exists(fname + ext):
+                return fname + ext
+    return fname
+
+
+def _file_state(fname):
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def aggregate_sweep(par_fname, keys=(), quantities=None, workers=None, 
+                    cache=True):
+    """
+    Collect parameter values and output quantities of all runs of a parameter 
+    sweep into a table.
+    
+    par_fname:  name of the parameter (.par) file
+    keys:       names of the parameters to be read with read_par
+    quantities: dictionary mapping a column name to a specification 
+                tuple (ext, *args): the value is read from the file 
+                <basename><ext> in the directory of the parameter file with 
+                read_out (ext='.out'), read_inp (ext='.inp') or read_his 
+                (ext='.his*') called with the additional arguments args
+    workers:    number of worker processes; None means the number of CPUs
+    cache:      if True, use and update the cache file <par_fname>.cache
+    
+    Returns a dictionary mapping the column names 'basename', the keys and the 
+    names of the quantities to lists with one value per run. Values that could 
+    not be read are None.
+    """
+    if quantities is None:
+        quantities = {}
+    for spec in quantities.values():
+        _reader(spec[0])    # raises ValueError for unsupported extensions
+    basenames = read_par(par_fname)
+    table = {'basename': basenames}
+    for key in keys:
+        table[key] = read_par(par_fname, key)[1]
+    
+    # determine the values that are not in the cache
+    directory = os.path.dirname(par_fname)
+    cache_name = par_fname + '.cache'
+    cached = _load_cache(cache_name) if cache else {}
+    columns = {name: [None]*len(basenames) for name in quantities}
+    runs = []
+    for irun, basename in enumerate(basenames):
+        jobs = []
+        for name, spec in quantities.items():
+            fname = _output_file(os.path.join(directory, 
+                                              basename + spec[0]))
+            entry = cached.get((fname, spec))
+            state = _file_state(fname)
+            if entry is not None and state is not None and entry[0] == state:
+                columns[name][irun] = entry[1]
+            else:
+                jobs.append((name, fname, spec, state))
+        if jobs:
+            runs.append((irun, jobs))
+    
+    # read the missing values
+    job_lists = [[(fname, spec) for __, fname, spec, __ in jobs] 
+                 for __, jobs in runs]
+    if workers == 1 or len(runs) <= 1:
+        results = [_extract_run(jobs) for jobs in job_lists]
+    else:
+        nworkers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                _extract_run, job_lists, 
+                chunksize=max(1, len(job_lists) // (4*nworkers))))
+    for (irun, jobs), values in zip(runs, results):
+        for (name, fname, spec, state), value in zip(jobs, values):
+            columns[name][irun] = value
+            if value is not None and state is not None:
+                cached[(fname, spec)] = state, value
+    
+    if cache and runs:
+        try:
+            with open(cache_name, 'wb') as f:
+                pickle.dump(cached, f)
+        except OSError:
+            print('Could not write', cache_name)
+    
+    table.update(columns)
+    return table
@@ -0,0 +1,272 @@
+#! /usr/bin/env python3
+"""
+Spatial index over the collision points of IMSIL trajectory (.tra) files.
+
+Usage:
+
+     python tra_regions.py <filename> zmin zmax
+
+prints the number of collision points and of atoms coming to rest (IFLAG=3) in
+the depth slab zmin <= z < zmax of the trajectory file <filename>.
+
+The collision points of all cascades are read once (see
+read_output.iter_cascade_blocks) and sorted into the cells of a uniform grid
+over x, y and z. Box, slab and sphere queries only look at the points of the
+cells overlapping the region. The index is stored in the file <fname>.pidx
+together with the size and the modification time of the tra file and is
+rebuilt if these do not match.
+"""
+import os, sys, zipfile
+import numpy as np
+from read_output import TRA_DTYPE, iter_cascade_blocks, savez_atomic
+
+
+def _ranges(starts, stops):
+    """
+    Return the concatenation of the index ranges starts[i] to stops[i]-1.
+    """
+    lengths = stops - starts
+    nonempty = lengths > 0
+    starts = starts[nonempty]
+    lengths = lengths[nonempty]
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1]) + np.repeat(starts - (ends - lengths), lengths)
+
+
+class PointIndex:
+    """
+    Collision points of a tra file sorted into the cells of a uniform grid.
+
+    points:       structured array (read_output.TRA_DTYPE) of the collision
+                  points, sorted by cell
+    casc:         cascade number (from 1) of each point
+    point:        index of each point in the tra file (from 0)
+    origin:       lower corner (x, y, z) of the grid
+    cell_size:    edge length of the cubic cells
+    shape:        number of cells (nz, ny, nx); the cell (iz, iy, ix) has the
+                  number (iz*ny + iy)*nx + ix
+    cell_offsets: points[cell_offsets[c]:cell_offsets[c+1]] are the points of
+                  cell c
+
+    Queries return indices into points (and casc and point). They take an
+    optional boolean mask over points to restrict the query to some kind of
+    points, e.g. index.points['iflag'] == 3 for atoms coming to rest.
+    """
+    def __init__(self, points, casc, point, origin, cell_size, shape,
+                 cell_offsets):
+        self.points = points
+        self.casc = casc
+        self.point = point
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.shape = tuple(int(n) for n in shape)
+        self.cell_offsets = cell_offsets
+
+    @classmethod
+    def from_points(cls, points, casc, cell_size=None, points_per_cell=32):
+        """
+        Build the index from collision points in file order.
+
+        casc:            cascade number of each point
+        cell_size:       edge length of the cells; None means that the cell
+                         size is chosen such that there are about
+                         points_per_cell points per cell on average
+        """
+        xyz = np.stack((points['z'], points['y'], points['x']), axis=1)
+        if len(points):
+            lo = xyz.min(axis=0)
+            extent = xyz.max(axis=0) - lo
+        else:
+            lo = extent = np.zeros(3)
+        if cell_size is None:
+            ncells = max(1., len(points) / points_per_cell)
+            flat = extent > 0
+            if np.any(flat):
+                cell_size = (np.prod(extent[flat]) / ncells)**(1/np.sum(flat))
+            else:
+                cell_size = 1.
+        shape = np.maximum(1, np.ceil(extent / cell_size).astype(np.int64))
+
+        ijk = np.minimum(((xyz - lo) / cell_size).astype(np.int64), shape-1)
+        cell = (ijk[:, 0]*shape[1] + ijk[:, 1])*shape[2] + ijk[:, 2]
+        order = np.argsort(cell, kind='stable')
+        cell_offsets = np.concatenate(((0,), np.cumsum(
+            np.bincount(cell, minlength=np.prod(shape)))))
+        return cls(points[order], np.asarray(casc)[order], order, lo[::-1],
+                   cell_size, shape, cell_offsets)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell_range(self, lo, hi):
+        """
+        Return the ranges of cell indices (first, last+1) along z, y, x
+        overlapping the box lo <= (x, y, z) <= hi.
+        """
+        lo = (np.asarray(lo, dtype=np.float64) - self.origin)[::-1]
+        hi = (np.asarray(hi, dtype=np.float64) - self.origin)[::-1]
+        shape = np.array(self.shape)
+        with np.errstate(invalid='ignore'):
+            first = np.clip(np.floor(lo / self.cell_size), 0, shape-1)
+            last = np.clip(np.floor(hi / self.cell_size) + 1, 0, shape)
+        return first.astype(np.int64), last.astype(np.int64)
+
+    def box(self, lo, hi, mask=None):
+        """
+        Return the indices of the points with lo <= (x, y, z) < hi.
+        Coordinates of lo and hi may be -np.inf and np.inf.
+        """
+        first, last = self._cell_range(lo, hi)
+        if np.any(last <= first):
+            return np.zeros(0, dtype=np.int64)
+        nz, ny, nx = self.shape
+        iz, iy = np.meshgrid(np.arange(first[0], last[0]),
+                             np.arange(first[1], last[1]), indexing='ij')
+        rows = ((iz*ny + iy)*nx).ravel()
+        # each row of cells along x is a contiguous range of points
+        starts = self.cell_offsets[rows + first[2]]
+        stops = self.cell_offsets[rows + last[2]]
+        idx = _ranges(starts, stops)
+
+        candidates = self.points[idx]
+        inside = np.ones(len(idx), dtype=bool)
+        for name, l, h in zip('xyz', lo, hi):
+            coordinate = candidates[name]
+            inside &= (coordinate >= l) & (coordinate < h)
+        if mask is not None:
+            inside &= mask[idx]
+        return idx[inside]
+
+    def slab(self, lo, hi, axis='z', mask=None):
+        """
+        Return the indices of the points with lo <= axis < hi, axis being 'x',
+        'y' or 'z'.
+        """
+        box_lo = [-np.inf]*3
+        box_hi = [np.inf]*3
+        box_lo['xyz'.index(axis)] = lo
+        box_hi['xyz'.index(axis)] = hi
+        return self.box(box_lo, box_hi, mask)
+
+    def sphere(self, center, radius, mask=None):
+        """
+        Return the indices of the points within the distance radius from
+        center (x, y, z).
+        """
+        center = np.asarray(center, dtype=np.float64)
+        idx = self.box(center - radius, center + radius, mask)
+        candidates = self.points[idx]
+        r2 = sum((candidates[name] - c)**2 for name, c in zip('xyz', center))
+        return idx[r2 <= radius**2]
+
+    def count_box(self, lo, hi, mask=None):
+        """
+        Return the number of points with lo <= (x, y, z) < hi (see box).
+        """
+        return len(self.box(lo, hi, mask))
+
+    def slab_counts(self, edges, axis='z', mask=None):
+        """
+        Return the numbers of points in the slabs edges[i] <= axis < edges[i+1].
+        """
+        idx = self.slab(edges[0], edges[-1], axis, mask)
+        counts, __ = np.histogram(self.points[axis][idx], edges)
+        return counts
+
+    def cell_counts(self, mask=None):
+        """
+        Return the number of points in each cell as an array (nz, ny, nx).
+        """
+        counts = np.diff(self.cell_offsets)
+        if mask is not None:
+            cell = np.repeat(np.arange(len(counts)), counts)
+            counts = np.bincount(cell[mask], minlength=len(counts))
+        return counts.reshape(self.shape)
+
+    def save(self, fname, **extra):
+        """
+        Store the index in the npz file fname (see read_output.savez_atomic).
+        """
+        savez_atomic(fname, points=self.points, casc=self.casc,
+                     point=self.point, origin=self.origin,
+                     cell_size=self.cell_size, shape=self.shape,
+                     cell_offsets=self.cell_offsets, **extra)
+
+
+def build_point_index(fname, cell_size=None, block_size=2**24):
+    """
+    Read all collision points of a tra file and return their PointIndex.
+
+    fname:      name of .tra file
+    cell_size:  see PointIndex.from_points
+    block_size: number of bytes parsed at once
+    """
+    pieces = []
+    cascs = []
+    ncasc = 0
+    for points, offsets in iter_cascade_blocks(fname, block_size):
+        pieces.append(points)
+        cascs.append(ncasc + 1 + np.repeat(np.arange(len(offsets)-1),
+                                           np.diff(offsets)))
+        ncasc += len(offsets) - 1
+    if pieces:
+        points = np.concatenate(pieces)
+        casc = np.concatenate(cascs)
+    else:
+        points = np.zeros(0, dtype=TRA_DTYPE)
+        casc = np.zeros(0, dtype=np.int64)
+    return PointIndex.from_points(points, casc, cell_size)
+
+
+def point_index(fname, cell_size=None, build=True):
+    """
+    Return the PointIndex of a tra file, stored in the file <fname>.pidx.
+
+    fname:     name of .tra file
+    cell_size: see PointIndex.from_points; a stored index with a different
+               cell size is rebuilt unless cell_size is None
+    build:     if False, return None instead of building a missing or outdated
+               index
+    """
+    stat = os.stat(fname)
+    index_name = fname + '.pidx'
+    try:
+        with np.load(index_name) as index:
+            if (index['size'] == stat.st_size and
+                index['mtime'] == stat.st_mtime_ns and
+                (cell_size is None or index['cell_size'] == cell_size)):
+                return PointIndex(index['points'], index['casc'],
+                                  index['point'], index['origin'],
+                                  index['cell_size'], index['shape'],
+                                  index['cell_offsets'])
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        pass    # missing or damaged index, treated as outdated
+
+    if not build:
+        return None
+    index = build_point_index(fname, cell_size)
+    try:
+        index.save(index_name, size=stat.st_size, mtime=stat.st_mtime_ns)
+    except OSError:
+        print('Could not write', index_name)
+    return index
+
+
+def main():
+    if len(sys.argv) != 4:
+        sys.exit('Usage: python ' + __file__ + ' filename zmin zmax')
+
+    index = point_index(sys.argv[1])
+    zmin, zmax = float(sys.argv[2]), float(sys.argv[3])
+    at_rest = index.points['iflag'] == 3
+    print(len(index), 'collision points in',
+          len(np.unique(index.casc)), 'cascades')
+    print('collision points in slab:', len(index.slab(zmin, zmax)))
+    print('atoms at rest in slab:   ', len(index.slab(zmin, zmax,
+                                                        mask=at_rest)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+"""
+Per-cascade statistics of IMSIL trajectory (.tra) files.
+
+Usage:
+
+     python tra_stats.py <filename>
+
+prints the moments of the cascade quantities of the trajectory file <filename>.
+
+The file is read once in blocks of complete cascades (see 
+read_output.iter_cascade_blocks), and for each cascade the following quantities 
+are derived from the columns of the collision points:
+
+* points:        number of collision points
+* energy:        energy of the ion at the first point
+* depth:         z coordinate where the ion comes to rest (NaN if the ion is 
+                 backscattered or transmitted)
+* max_depth:     maximum z coordinate of all collision points
+* lateral:       root mean square lateral distance of the interstitials from 
+                 the first point of the ion (NaN if there are none)
+* recoils:       number of recoil trajectories (IG>1, IFLAG=1)
+* interstitials: number of atoms coming to rest in the target (IFLAG=3)
+* sputtered:     number of backscattered recoils (IG>1, IFLAG=4)
+* backscattered: 1 if the ion is backscattered (IG=1, IFLAG=4), else 0
+* transmitted:   1 if the ion is transmitted (IG=1, IFLAG=5), else 0
+
+Virtual atoms (I1<0) are not counted.
+"""
+import sys
+import numpy as np
+from read_output import iter_cascade_blocks
+
+
+SUMMARY_DTYPE = np.dtype([('points', 'i8'), ('energy', 'f8'), 
+                          ('depth', 'f8'), ('max_depth', 'f8'), 
+                          ('lateral', 'f8'), ('recoils', 'i8'), 
+                          ('interstitials', 'i8'), ('sputtered', 'i8'), 
+                          ('backscattered', 'i8'), ('transmitted', 'i8')])
+
+
+def summarize_block(points, offsets):
+    """
+    Return the cascade summary (SUMMARY_DTYPE) of a block of complete cascades.
+    
+    points:  collision points (read_output.TRA_DTYPE)
+    offsets: cascade offsets, points[offsets[i]:offsets[i+1]] being the points 
+             of the i-th cascade
+    """
+    starts = offsets[:-1]
+    npoints = np.diff(offsets)
+    ncasc = len(npoints)
+    cid = np.repeat(np.arange(ncasc), npoints)
+    i1 = points['i1']
+    ig = points['ig']
+    iflag = points['iflag']
+    z = points['z']
+    real = i1 > 0
+    ion = (ig == 1) & real
+    recoil = (ig > 1) & real
+    
+    def count(mask):
+        return np.add.reduceat(mask.astype(np.int64), starts)
+    
+    summary = np.zeros(ncasc, dtype=SUMMARY_DTYPE)
+    summary['points'] = npoints
+    summary['energy'] = points['e'][starts]
+    summary['max_depth'] = np.maximum.reduceat(z, starts)
+    
+    stopped = ion & (iflag == 3)
+    depth = np.full(ncasc, np.nan)
+    depth[cid[stopped]] = z[stopped]
+    summary['depth'] = depth
+    
+    interstitial = real & (iflag == 3)
+    dx = points['x'] - points['x'][starts][cid]
+    dy = points['y'] - points['y'][starts][cid]
+    r2 = np.where(interstitial, dx**2 + dy**2, 0.)
+    nint = count(interstitial)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['lateral'] = np.sqrt(np.add.reduceat(r2, starts) / nint)
+    
+    summary['recoils'] = count(recoil & (iflag == 1))
+    summary['interstitials'] = nint
+    summary['sputtered'] = count(recoil & (iflag == 4))
+    summary['backscattered'] = count(ion & (iflag == 4))
+    summary['transmitted'] = count(ion & (iflag == 5))
+    return summary
+
+
+def summarize_cascades(fname, block_size=2**24):
+    """
+    Read a tra file once and return the summary table (SUMMARY_DTYPE) with one 
+    entry per cascade.
+    
+    fname:      name of .tra file
+    block_size: number of bytes parsed at once
+    """
+    summaries = [summarize_block(points, offsets) 
+                 for points, offsets in iter_cascade_blocks(fname, block_size)]
+    if not summaries:
+        return np.zeros(0, dtype=SUMMARY_DTYPE)
+    return np.concatenate(summaries)
+
+
+def summary_moments(summary):
+    """
+    Return a dictionary mapping each quantity of the summary table to its mean 
+    value, standard deviation, skewness and kurtosis over all cascades. NaN 
+    values are ignored.
+    """
+    moments = {}
+    for name in summary.dtype.names:
+        values = summary[name].astype(np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            moments[name] = (np.nan,)*4
+            continue
+        mean = np.mean(values)
+        std = np.std(values)
+        if std > 0:
+            skewness = np.mean((values - mean)**3) / std**3
+            kurtosis = np.mean((values - mean)**4) / std**4
+        else:
+            skewness = kurtosis = np.nan
+        moments[name] = mean, std, skewness, kurtosis
+    return moments
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python ' + __file__ + ' filename')
+    
+    summary = summarize_cascades(sys.argv[1])
+    print(len(summary), 'cascades')
+    print('%-14s %12s %12s %12s %12s' 
+          % ('', 'mean value', 'std.dev.', 'skewness', 'kurtosis'))
+    for name, moments in summary_moments(summary).items():
+        print('%-14s %12.5g %12.5g %12.5g %12.5g' % ((name,) + moments))
+
+
+if __name__ == '__main__':
+    main()